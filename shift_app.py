@@ -1,19 +1,16 @@
 import streamlit as st
 import pandas as pd
 import datetime
+import os
 import uuid # For unique IDs
 from io import BytesIO
-from collections import defaultdict
+from shift_engine import SHIFT_PRESETS, STAFF_LIMITS, build_summary, count_assignments, generate_schedule, repair_schedule
+from shift_cache import RevisionCache, current_revision
+from shift_store import ShiftStore
+from shift_import import build_roster_template, parse_roster, read_roster
+from shift_export import write_csv, write_excel, write_parquet
+from shift_template import WEEKDAY_NAMES
 
-# --- シフトプリセットの定義 ---
-SHIFT_PRESETS = [
-    {"name": "中学生自習対応・マナビス (16時半開始)", "start_time": datetime.time(16, 30), "end_time": datetime.time(21, 40)}, 
-    {"name": "小5ONLINE英語のサポート/中学生自習対応・マナビス", "start_time": datetime.time(18, 0), "end_time": datetime.time(21, 40)},
-    {"name": "中学生自習対応・マナビス (18時開始)", "start_time": datetime.time(18, 0), "end_time": datetime.time(21, 40)}, 
-    {"name": "速読・自習室巡回(土曜午前)", "start_time": datetime.time(9, 0), "end_time": datetime.time(12, 30)}, 
-    {"name": "自習対応・マナビス(土曜午後)", "start_time": datetime.time(15, 30), "end_time": datetime.time(21, 0)}, 
-    {"name": "中学生自習対応・マナビス (日曜昼)", "start_time": datetime.time(13, 30), "end_time": datetime.time(18, 0)},
-]
 # --- ここからパスワード保護の関数 (Secrets利用版) ---
 def check_password():
     if "password_correct" not in st.session_state:
@@ -55,58 +52,186 @@ if not check_password():
 # --- アプリケーションのタイトル ---
 st.title("シフト管理アプリケーション (Streamlit版)")
 
+# --- 共有リソース: データストアと派生データのキャッシュ (全セッションで 1 つ) ---
+@st.cache_resource
+def get_store():
+    return ShiftStore(os.environ.get("SHIFT_APP_DB", "shift_data.sqlite3"))
+
+@st.cache_resource
+def get_view_cache():
+    return RevisionCache(max_entries=64)
+
+store = get_store()
+view_cache = get_view_cache()
+
+def set_schedule(all_positions):
+    # 表示するシフト表 (PositionTable、未生成なら None) と集計を入れ替える
+    if all_positions is None:
+        st.session_state.generated_schedule, st.session_state.employee_summary = None, None
+    else:
+        summary_data = build_summary(st.session_state.employees, count_assignments(st.session_state.employees, all_positions))
+        st.session_state.generated_schedule = all_positions  # PositionTable (表示用の DataFrame は view_cache で作る)
+        st.session_state.employee_summary = pd.DataFrame(summary_data) if summary_data else pd.DataFrame()
+
+def sync_from_store(reload_schedule=True):
+    # ストアのリビジョンが進んでいるデータ (他のセッションの編集を含む) だけを読み直す
+    # reload_schedule が False なら、シフト表は読み直さない (すぐに組み直して置き換える場合)
+    revisions = store.revisions()
+    loaded_revisions = st.session_state.get('data_revision', {})
+    period = (st.session_state.schedule_period_start, st.session_state.schedule_period_end)
+    period_changed = st.session_state.get('loaded_period') != period
+    if revisions['employees'] != loaded_revisions.get('employees'):
+        st.session_state.employees = store.load_employees()
+        st.session_state.employees_by_id = {emp['id']: emp for emp in st.session_state.employees}
+    if revisions['timetable'] != loaded_revisions.get('timetable') or period_changed:
+        st.session_state.timetable = store.load_timetable(*period)
+    if reload_schedule and (revisions != loaded_revisions or period_changed):
+        set_schedule(store.load_schedule(st.session_state.timetable, st.session_state.employees, *period))
+    st.session_state.data_revision = revisions
+    st.session_state.loaded_period = period
+
 # --- 初期化: st.session_state ---
-if 'employees' not in st.session_state: st.session_state.employees = [] 
-if 'timetable' not in st.session_state: st.session_state.timetable = {} 
 if 'schedule_period_start' not in st.session_state: st.session_state.schedule_period_start = datetime.date.today()
 if 'schedule_period_end' not in st.session_state: st.session_state.schedule_period_end = datetime.date.today() + datetime.timedelta(days=6)
-if 'generated_schedule' not in st.session_state: st.session_state.generated_schedule = None
-if 'employee_summary' not in st.session_state: st.session_state.employee_summary = None
+sync_from_store()
 
 # --- Helper Functions ---
-def generate_excel(schedule_df, summary_df):
+EXPORT_FORMATS = {
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "text/csv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+}
+
+def export_schedule(all_positions, summary_df, export_format, per_staff=False, per_month=False):
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        if schedule_df is not None and not schedule_df.empty: schedule_df.to_excel(writer, sheet_name='シフト表', index=False)
-        if summary_df is not None and not summary_df.empty: summary_df.to_excel(writer, sheet_name='従業員別集計', index=False)
+    if export_format == "xlsx": write_excel(all_positions, summary_df.to_dict('records') if summary_df is not None else [], output, per_staff=per_staff, per_month=per_month)
+    elif export_format == "csv": write_csv(all_positions, output)
+    else: write_parquet(all_positions, output)
     return output.getvalue()
 
+def apply_edit(write, changed_employee_ids=()):
+    # 編集をストアに書き込み、生成済みのシフト表があれば影響を受けた部分だけを組み直して、担当者が変わった割当だけを保存する
+    previous_schedule = st.session_state.generated_schedule
+    write()
+    if previous_schedule is None or len(previous_schedule) == 0:
+        sync_from_store(); return
+    sync_from_store(reload_schedule=False)
+    all_positions, _ = repair_schedule(st.session_state.employees, st.session_state.timetable, st.session_state.schedule_period_start, st.session_state.schedule_period_end, previous_schedule, changed_employee_ids, pin_existing=st.session_state.get("pin_existing_assignments", False))
+    store.save_schedule(all_positions, st.session_state.schedule_period_start, st.session_state.schedule_period_end, previous=previous_schedule)
+    expected_revisions = {**st.session_state.data_revision, 'schedule': st.session_state.data_revision['schedule'] + 1}
+    if store.revisions() == expected_revisions:
+        # 他のセッションの書き込みがなければ、組み直したシフト表をそのまま使う (ストアから読み直さない)
+        set_schedule(all_positions)
+        st.session_state.data_revision = expected_revisions
+    else:
+        sync_from_store()
+
+def format_limits(emp):
+    parts = [f"{label} {emp[key]:g}" for key, label in STAFF_LIMITS.items() if emp.get(key) is not None]
+    return ", ".join(parts) if parts else "制限なし"
+
+LIMIT_MIN_VALUES = {'max_daily_shifts': 1, 'max_daily_hours': 0.5, 'max_weekly_hours': 0.5, 'min_rest_hours': 0.0}  # 上限時間は 0 より大きい (一括登録と同じ)
+
+def limit_inputs(key_prefix, current=None):
+    # 勤務条件の入力欄。空欄は制限なし (None)。一括登録で最小値より小さい値が入っていれば、その値まで入力できるようにする
+    current = current or {}
+    cols = st.columns(len(STAFF_LIMITS))
+    return {key: col.number_input(label, min_value=LIMIT_MIN_VALUES[key] if current.get(key) is None else min(LIMIT_MIN_VALUES[key], current[key]), step=1 if key == 'max_daily_shifts' else 0.5, value=current.get(key), placeholder="制限なし", key=f"{key_prefix}_{key}") for col, (key, label) in zip(cols, STAFF_LIMITS.items())}
+
+def build_staff_table(employees):
+    emp_data_display = []
+    for emp in employees:
+        available_dates_str = ", ".join([d.strftime("%m/%d") for d in sorted(emp['available_dates'])]) if emp['available_dates'] else "未登録"
+        emp_data_display.append({"ID": emp['id'], "名前": emp['name'], "希望日数": emp['desired_shifts'], "勤務条件": format_limits(emp), "勤務可能日": available_dates_str})
+    return pd.DataFrame(emp_data_display)
+
+def build_timetable_summary(timetable, period_start, period_end):
+    timetable_display_data = []
+    for date_key in sorted(d for d in timetable.keys() if period_start <= d <= period_end):
+        for shift in timetable[date_key]:
+            timetable_display_data.append({"日付": date_key.strftime("%Y-%m-%d (%a)"), "シフト名": shift['name'], "時間": f"{shift['start_time'].strftime('%H:%M')} - {shift['end_time'].strftime('%H:%M')}", "必要人数": shift['required_people'], "区分": "毎週" if shift.get('rule_id') else "個別"})
+    return pd.DataFrame(timetable_display_data)
+
+def build_schedule_display(all_positions):
+    display_df = pd.DataFrame(all_positions.columns()).sort_values(by=['date', 'start_time', 'shift_name'])
+    display_df['date_str'] = display_df['date'].apply(lambda x: x.strftime("%Y-%m-%d (%a)"))
+    display_df['start_time_str'] = display_df['start_time'].apply(lambda x: x.strftime("%H:%M"))
+    display_df['end_time_str'] = display_df['end_time'].apply(lambda x: x.strftime("%H:%M"))
+    return display_df
+
+def build_schedule_pivot(display_df):
+    schedule_pivot = display_df.pivot_table(index=['date_str', 'shift_name', 'start_time_str', 'end_time_str'], columns='position_index', values='assigned_employee_name', aggfunc='first').reset_index()
+    schedule_pivot = schedule_pivot.rename(columns={'date_str':'日付', 'shift_name':'シフト名', 'start_time_str':'開始', 'end_time_str':'終了'})
+    num_cols = len([col for col in schedule_pivot.columns if isinstance(col, int)])
+    return schedule_pivot.rename(columns={i: f'担当者{i+1}' for i in range(num_cols)})
+
 # --- 1. 従業員管理 ---
 st.header("1. スタッフ管理")
 with st.expander("スタッフを追加する"):
     with st.form("new_employee_form", clear_on_submit=True):
         emp_name = st.text_input("スタッフ名", key="emp_name_input")
         desired_shifts = st.number_input("希望シフト日数", min_value=0, step=1, key="desired_shifts_input")
+        st.caption("勤務条件 (空欄なら制限なし)。時間帯が重ならなければ同じ日に複数のシフトに入れます。")
+        new_limits = limit_inputs("new_emp")
         submitted_emp = st.form_submit_button("スタッフを追加")
         if submitted_emp and emp_name:
             emp_id = str(uuid.uuid4())
-            st.session_state.employees.append({'id': emp_id, 'name': emp_name, 'desired_shifts': desired_shifts, 'available_dates': []})
+            store.add_employee({'id': emp_id, 'name': emp_name, 'desired_shifts': desired_shifts, 'available_dates': [], **new_limits})
+            sync_from_store()
             st.success(f"{emp_name}さんを追加しました。次に勤務可能日を登録してください。")
 if st.session_state.employees:
     with st.expander("勤務可能日を登録・編集する"):
-        selected_emp_id_for_dates = st.selectbox("従業員を選択", options=[emp['id'] for emp in st.session_state.employees], format_func=lambda x: next(emp['name'] for emp in st.session_state.employees if emp['id'] == x), key="emp_select_for_dates")
+        selected_emp_id_for_dates = st.selectbox("従業員を選択", options=[emp['id'] for emp in st.session_state.employees], format_func=lambda x: st.session_state.employees_by_id[x]['name'], key="emp_select_for_dates")
         if selected_emp_id_for_dates:
-            employee_to_edit = next(emp for emp in st.session_state.employees if emp['id'] == selected_emp_id_for_dates)
+            employee_to_edit = st.session_state.employees_by_id[selected_emp_id_for_dates]
             date_options = []
             if st.session_state.schedule_period_start and st.session_state.schedule_period_end and st.session_state.schedule_period_start <= st.session_state.schedule_period_end:
                 current_date_opt = st.session_state.schedule_period_start
                 while current_date_opt <= st.session_state.schedule_period_end: date_options.append(current_date_opt); current_date_opt += datetime.timedelta(days=1)
             if not date_options: st.warning("先に「2. タイムテーブル管理」でスケジュール期間を設定してください。")
-            current_available_dates = employee_to_edit['available_dates']
+            # 保存済みの勤務可能日のうち、表示中の期間外の日付は編集対象にせずそのまま残す
+            current_available_dates = [d for d in employee_to_edit['available_dates'] if st.session_state.schedule_period_start <= d <= st.session_state.schedule_period_end]
+            other_available_dates = [d for d in employee_to_edit['available_dates'] if not st.session_state.schedule_period_start <= d <= st.session_state.schedule_period_end]
             new_available_dates = st.multiselect(f"{employee_to_edit['name']}さんの勤務可能日を選択 (スケジュール期間内)", options=date_options, default=current_available_dates, format_func=lambda d: d.strftime("%Y-%m-%d (%a)"), key=f"available_dates_{selected_emp_id_for_dates}")
             if st.button(f"{employee_to_edit['name']}さんの勤務可能日を更新", key=f"update_dates_btn_{selected_emp_id_for_dates}"):
-                employee_to_edit['available_dates'] = new_available_dates
+                apply_edit(lambda: store.set_available_dates(selected_emp_id_for_dates, other_available_dates + new_available_dates), [selected_emp_id_for_dates])
                 st.success(f"{employee_to_edit['name']}さんの勤務可能日を更新しました。")
+            st.caption("勤務条件 (空欄なら制限なし)")
+            edited_limits = limit_inputs(f"limits_{selected_emp_id_for_dates}", employee_to_edit)
+            if st.button(f"{employee_to_edit['name']}さんの勤務条件を更新", key=f"update_limits_btn_{selected_emp_id_for_dates}"):
+                apply_edit(lambda: store.set_limits(selected_emp_id_for_dates, edited_limits), [selected_emp_id_for_dates])
+                st.success(f"{employee_to_edit['name']}さんの勤務条件を更新しました。")
+with st.expander("CSV/Excelで一括登録する"):
+    st.markdown(f"1行に1人、列は「ID」(任意)・「名前」・「希望日数」と日付 (YYYY-MM-DD) です。勤務可能な日のセルに ○ または 1 を入れてください。勤務条件の列 ({'・'.join(STAFF_LIMITS.values())}) は任意で、空欄なら制限なしです。既存のスタッフはIDまたは名前で照合して上書きします。")
+    # ボタンが押されたときの呼び出しはスクリプトのスレッドの外なので、st.session_state はここで読んでおく
+    template_employees, template_start, template_end = st.session_state.employees, st.session_state.schedule_period_start, st.session_state.schedule_period_end
+    st.download_button(
+        label="現在の登録内容をテンプレートとしてダウンロード (CSV)",
+        data=lambda: build_roster_template(template_employees, template_start, template_end).to_csv(index=False).encode("utf-8-sig"),
+        file_name=f"roster_{template_start.strftime('%Y%m%d')}.csv",
+        mime="text/csv",
+        key="download_roster_template_btn"
+    )
+    roster_file = st.file_uploader("スタッフ・勤務可能日の表 (CSV / XLSX)", type=["csv", "xlsx"], key="roster_uploader")
+    if roster_file is not None:
+        try:
+            roster_df = read_roster(roster_file, roster_file.name)
+        except Exception as e:
+            st.error(f"ファイルを読み込めませんでした: {e}"); roster_df = None
+        if roster_df is not None:
+            imported_employees, import_errors = parse_roster(roster_df, st.session_state.schedule_period_start, st.session_state.schedule_period_end, st.session_state.employees)
+            for message in import_errors: st.error(message)
+            if imported_employees:
+                st.info(f"{len(imported_employees)}人分を読み込みました (新規 {sum(emp['id'] not in st.session_state.employees_by_id for emp in imported_employees)}人)。")
+                if st.button("この内容で一括登録", key="import_roster_btn"):
+                    apply_edit(lambda: store.import_employees(imported_employees, st.session_state.schedule_period_start, st.session_state.schedule_period_end), [emp['id'] for emp in imported_employees])
+                    st.success(f"{len(imported_employees)}人分のスタッフ・勤務可能日を登録しました。")
 st.subheader("登録済みスタッフリスト")
 if st.session_state.employees:
-    emp_data_display = []
-    for emp in st.session_state.employees:
-        available_dates_str = ", ".join([d.strftime("%m/%d") for d in sorted(emp['available_dates'])]) if emp['available_dates'] else "未登録"
-        emp_data_display.append({"ID": emp['id'], "名前": emp['name'], "希望日数": emp['desired_shifts'], "勤務可能日": available_dates_str})
-    st.dataframe(pd.DataFrame(emp_data_display))
-    emp_to_delete_id = st.selectbox("削除するスタッフを選択 (注意: 即時削除されます)", options=[None] + [emp['id'] for emp in st.session_state.employees], format_func=lambda x: "選択してください" if x is None else next(emp['name'] for emp in st.session_state.employees if emp['id'] == x), key="emp_delete_select")
+    st.dataframe(view_cache.get_or_build("staff_table", current_revision(st.session_state, "employees"), lambda: build_staff_table(st.session_state.employees)))
+    emp_to_delete_id = st.selectbox("削除するスタッフを選択 (注意: 即時削除されます)", options=[None] + [emp['id'] for emp in st.session_state.employees], format_func=lambda x: "選択してください" if x is None else st.session_state.employees_by_id[x]['name'], key="emp_delete_select")
     if emp_to_delete_id and st.button("選択したスタッフを削除", key="delete_emp_btn"):
-        st.session_state.employees = [emp for emp in st.session_state.employees if emp['id'] != emp_to_delete_id]
+        apply_edit(lambda: store.delete_employee(emp_to_delete_id))
         st.rerun()
 else: st.info("まだスタッフが登録されていません。")
 
@@ -126,30 +251,32 @@ if new_period_start_input != initial_period_start or new_period_end_input != ini
     st.session_state.schedule_period_end = new_period_end_input
     period_actually_changed = True 
 if period_actually_changed:
-    if st.session_state.schedule_period_start <= st.session_state.schedule_period_end:
-        default_shifts_config = {
-            0: [("中学生自習対応・マナビス (18時開始)", 1)], 1: [("中学生自習対応・マナビス (18時開始)", 1)], 
-            2: [("中学生自習対応・マナビス (16時半開始)", 1)], 3: [("小5ONLINE英語のサポート/中学生自習対応・マナビス", 1)], 
-            4: [("中学生自習対応・マナビス (18時開始)", 1)], 
-            5: [("速読・自習室巡回", 1), ("自習対応・マナビス", 1)], 
-            6: [("中学生自習対応・マナビス (日曜昼)", 1)]
-        }
-        date_to_scan = st.session_state.schedule_period_start
-        while date_to_scan <= st.session_state.schedule_period_end:
-            if not st.session_state.timetable.get(date_to_scan): 
-                day_of_week = date_to_scan.weekday()
-                default_presets_for_day = default_shifts_config.get(day_of_week, [])
-                if default_presets_for_day:
-                    st.session_state.timetable[date_to_scan] = [] 
-                    for preset_name, req_people in default_presets_for_day:
-                        preset_details = next((p for p in SHIFT_PRESETS if p["name"] == preset_name), None)
-                        if preset_details:
-                            new_default_shift = {'id': str(uuid.uuid4()), 'name': preset_details["name"], 'start_time': preset_details["start_time"], 'end_time': preset_details["end_time"], 'required_people': req_people}
-                            st.session_state.timetable[date_to_scan].append(new_default_shift)
-                        else: st.warning(f"デフォルト設定エラー(期間変更時): プリセット '{preset_name}' が見つかりません。")
-            date_to_scan += datetime.timedelta(days=1)
+    # 毎週の定型シフト枠は表示・生成のときに日付へ展開するので、期間を変えても書き込みは不要
     st.rerun() 
 st.info(f"現在のスケジュール期間: {st.session_state.schedule_period_start.strftime('%Y-%m-%d')} ～ {st.session_state.schedule_period_end.strftime('%Y-%m-%d')}")
+with st.expander("毎週の定型シフト枠を設定・編集する"):
+    st.caption("定型シフト枠は期間内の該当する曜日すべてに入ります。特定の日だけ外す・追加する場合は下の「シフト枠を設定・編集する」で日付ごとに設定してください。")
+    weekly_rules = st.session_state.timetable.rules
+    if weekly_rules:
+        for rule in sorted(weekly_rules, key=lambda r: (r['weekday'], r['start_time'])):
+            cols = st.columns([1,4,3,1,1])
+            cols[0].text(WEEKDAY_NAMES[rule['weekday']])
+            cols[1].text(rule['name'])
+            cols[2].text(f"{rule['start_time'].strftime('%H:%M')} - {rule['end_time'].strftime('%H:%M')}")
+            cols[3].text(f"{rule['required_people']}人")
+            if cols[4].button("削除", key=f"delete_rule_{rule['id']}"):
+                apply_edit(lambda: store.delete_rule(rule['id']))
+                st.rerun()
+    else: st.info("定型シフト枠はまだありません。")
+    with st.form("new_rule_form", clear_on_submit=True):
+        rule_weekday = st.selectbox("曜日", options=list(range(7)), format_func=lambda w: WEEKDAY_NAMES[w], key="rule_weekday_select")
+        rule_preset_name = st.selectbox("シフトプリセット", options=[p["name"] for p in SHIFT_PRESETS], key="rule_preset_select")
+        rule_required_people = st.number_input("必要人数", min_value=1, step=1, key="rule_req_people")
+        if st.form_submit_button("定型シフト枠を追加"):
+            rule_preset = next(p for p in SHIFT_PRESETS if p["name"] == rule_preset_name)
+            new_rule = {'id': str(uuid.uuid4()), 'weekday': rule_weekday, 'name': rule_preset["name"], 'start_time': rule_preset["start_time"], 'end_time': rule_preset["end_time"], 'required_people': rule_required_people}
+            apply_edit(lambda: store.add_rule(new_rule))
+            st.success(f"毎週{WEEKDAY_NAMES[rule_weekday]}曜日に「{rule_preset_name}」を追加しました。"); st.rerun()
 with st.expander("シフト枠を設定・編集する"):
     if st.session_state.schedule_period_start > st.session_state.schedule_period_end: st.error("スケジュール期間の終了日は開始日以降に設定してください。")
     else:
@@ -169,11 +296,16 @@ with st.expander("シフト枠を設定・編集する"):
                         cols[2].text(f"- {shift_to_display['end_time'].strftime('%H:%M')}")
                         cols[3].text(f"{shift_to_display['required_people']}人")
                         button_key = f"delete_shift_{selected_date_for_shift.strftime('%Y%m%d')}_{shift_to_display['id']}"
-                        if cols[4].button("削除", key=button_key):
-                            st.session_state.timetable[selected_date_for_shift] = [s for s in st.session_state.timetable[selected_date_for_shift] if s['id'] != shift_to_display['id']]
-                            if not st.session_state.timetable.get(selected_date_for_shift):
-                                if selected_date_for_shift in st.session_state.timetable: del st.session_state.timetable[selected_date_for_shift]
+                        if cols[4].button("この日だけ外す" if shift_to_display.get('rule_id') else "削除", key=button_key):
+                            if shift_to_display.get('rule_id'): apply_edit(lambda: store.skip_rule(selected_date_for_shift, shift_to_display['rule_id']))
+                            else: apply_edit(lambda: store.delete_slot(shift_to_display['id']))
                             st.rerun()
+                for skipped_rule in st.session_state.timetable.skipped_rules(selected_date_for_shift):
+                    cols = st.columns([7,2])
+                    cols[0].text(f"(この日は外しています) {skipped_rule['name']} {skipped_rule['start_time'].strftime('%H:%M')} - {skipped_rule['end_time'].strftime('%H:%M')}")
+                    if cols[1].button("戻す", key=f"restore_rule_{selected_date_for_shift.strftime('%Y%m%d')}_{skipped_rule['id']}"):
+                        apply_edit(lambda: store.restore_rule(selected_date_for_shift, skipped_rule['id']))
+                        st.rerun()
                 with st.form(f"new_shift_form_{selected_date_for_shift}", clear_on_submit=True):
                     preset_options = ["手動入力"] + [p["name"] for p in SHIFT_PRESETS]
                     selected_preset_name = st.selectbox("シフトプリセットを選択 (または「手動入力」)", options=preset_options, key=f"preset_select_{selected_date_for_shift}")
@@ -202,85 +334,55 @@ with st.expander("シフト枠を設定・編集する"):
                         if act_start is None or act_end is None: st.error("時刻が未設定です。"); st.stop()
                         if act_start >= act_end: st.error("終了時刻は開始時刻より後に。"); st.stop()
                         new_shift = {'id': str(uuid.uuid4()), 'name': act_name, 'start_time': act_start, 'end_time': act_end, 'required_people': required_people}
-                        if selected_date_for_shift not in st.session_state.timetable: st.session_state.timetable[selected_date_for_shift] = []
-                        st.session_state.timetable[selected_date_for_shift].append(new_shift)
+                        apply_edit(lambda: store.add_slots([(selected_date_for_shift, new_shift)]))
                         st.success(f"{selected_date_for_shift.strftime('%Y-%m-%d')}に「{act_name}」シフトを追加。"); st.rerun()
         else: st.warning("スケジュール期間を正しく設定してください。")
 st.subheader("設定済みタイムテーブル概要")
 if st.session_state.timetable:
-    timetable_display_data = []
-    active_dates_in_period = [st.session_state.schedule_period_start + datetime.timedelta(days=x) for x in range((st.session_state.schedule_period_end - st.session_state.schedule_period_start).days + 1)] if st.session_state.schedule_period_start <= st.session_state.schedule_period_end else []
-    sorted_timetable_keys = sorted(st.session_state.timetable.keys())
-    for date_key in sorted_timetable_keys:
-        if date_key in active_dates_in_period: 
-            for shift in st.session_state.timetable[date_key]:
-                timetable_display_data.append({"日付": date_key.strftime("%Y-%m-%d (%a)"), "シフト名": shift['name'], "時間": f"{shift['start_time'].strftime('%H:%M')} - {shift['end_time'].strftime('%H:%M')}", "必要人数": shift['required_people']})
-    if timetable_display_data: st.dataframe(pd.DataFrame(timetable_display_data))
+    timetable_summary_df = view_cache.get_or_build("timetable_summary", current_revision(st.session_state, "timetable") + (st.session_state.schedule_period_start, st.session_state.schedule_period_end), lambda: build_timetable_summary(st.session_state.timetable, st.session_state.schedule_period_start, st.session_state.schedule_period_end))
+    if not timetable_summary_df.empty: st.dataframe(timetable_summary_df)
     else: st.info("期間内に設定されたシフト枠はありません。")
 else: st.info("まだシフト枠が設定されていません。")
 
 # --- 3. シフト自動生成と出力 ---
 st.header("3. シフト自動生成と出力")
+generation_mode = st.radio("生成方法", options=["greedy", "optimal"], format_func=lambda m: {"greedy": "高速 (貪欲法)", "optimal": "最適 (充足数を最大化し、希望日数との差を最小化)"}[m], horizontal=True, key="generation_mode_radio")
+optimal_time_limit = st.number_input("最適化の制限時間 (秒)", min_value=1, value=30, step=1, key="optimal_time_limit_input", disabled=generation_mode != "optimal")
+st.checkbox("スタッフ・シフト枠の編集時に既存の割当を固定する (空いた枠だけを埋め直す)", key="pin_existing_assignments")
 if st.button("シフトを自動生成する", key="generate_shifts_btn"):
     if not st.session_state.employees: st.error("スタッフが登録されていません。")
     elif not st.session_state.timetable: st.error("タイムテーブルが設定されていません。")
     else:
         with st.spinner("シフトを生成中です..."):
-            employees_map = {emp['id']: emp.copy() for emp in st.session_state.employees} 
-            for emp_id in employees_map: employees_map[emp_id]['actual_shifts'] = 0
-            all_positions = []
-            active_dates_keys = [d for d in st.session_state.timetable.keys() if st.session_state.schedule_period_start <= d <= st.session_state.schedule_period_end]
-            for date_val in sorted(active_dates_keys): 
-                if date_val in st.session_state.timetable: 
-                    for shift_slot in st.session_state.timetable[date_val]:
-                        for i in range(shift_slot['required_people']):
-                            all_positions.append({'date': date_val, 'shift_id': shift_slot['id'], 'shift_name': shift_slot['name'], 'start_time': shift_slot['start_time'], 'end_time': shift_slot['end_time'], 'position_index': i, 'assigned_employee_id': None, 'assigned_employee_name': "未割当"})
-            daily_assignment_tracker = defaultdict(lambda: defaultdict(bool)) 
-            MAX_ITERATIONS = len(all_positions) * 2 
-            for iteration in range(MAX_ITERATIONS):
-                best_assignment, max_need_score = None, -float('inf') 
-                unassigned_indices = [idx for idx, pos in enumerate(all_positions) if pos['assigned_employee_id'] is None]
-                if not unassigned_indices: break 
-                possible_assignments = []
-                for emp_id, emp_details in employees_map.items():
-                    need_score = emp_details['desired_shifts'] - emp_details['actual_shifts']
-                    for pos_idx in unassigned_indices:
-                        current_pos = all_positions[pos_idx]
-                        if current_pos['date'] in emp_details['available_dates'] and not daily_assignment_tracker[emp_id][current_pos['date']]:
-                            possible_assignments.append({'emp_id': emp_id, 'pos_idx': pos_idx, 'need_score': need_score})
-                if not possible_assignments: break 
-                possible_assignments.sort(key=lambda x: x['need_score'], reverse=True)
-                best_assign_info = possible_assignments[0]
-                assigned_emp_id, assigned_pos_idx = best_assign_info['emp_id'], best_assign_info['pos_idx']
-                all_positions[assigned_pos_idx]['assigned_employee_id'] = assigned_emp_id
-                all_positions[assigned_pos_idx]['assigned_employee_name'] = employees_map[assigned_emp_id]['name']
-                employees_map[assigned_emp_id]['actual_shifts'] += 1
-                daily_assignment_tracker[assigned_emp_id][all_positions[assigned_pos_idx]['date']] = True
-            st.session_state.generated_schedule = pd.DataFrame(all_positions) if all_positions else pd.DataFrame()
-            summary_data = [{"スタッフ名": emp['name'], "希望シフト数": emp['desired_shifts'], "実績シフト数": employees_map[emp['id']]['actual_shifts'], "差": employees_map[emp['id']]['actual_shifts'] - emp['desired_shifts']} for emp in st.session_state.employees]
-            st.session_state.employee_summary = pd.DataFrame(summary_data) if summary_data else pd.DataFrame()
+            try:
+                all_positions, _ = generate_schedule(st.session_state.employees, st.session_state.timetable, st.session_state.schedule_period_start, st.session_state.schedule_period_end, mode=generation_mode, time_limit=optimal_time_limit)
+            except (TimeoutError, RuntimeError) as e:
+                st.warning(f"{e} 高速 (貪欲法) で生成します。")
+                all_positions, _ = generate_schedule(st.session_state.employees, st.session_state.timetable, st.session_state.schedule_period_start, st.session_state.schedule_period_end)
+            store.save_schedule(all_positions, st.session_state.schedule_period_start, st.session_state.schedule_period_end)
+            sync_from_store()
             st.success("シフト生成が完了しました！")
 
 if st.session_state.generated_schedule is not None:
     st.subheader("生成されたシフト表")
-    display_df = st.session_state.generated_schedule.copy()
-    if not display_df.empty:
-        display_df = display_df.sort_values(by=['date', 'start_time', 'shift_name']) 
-        display_df['date_str'] = display_df['date'].apply(lambda x: x.strftime("%Y-%m-%d (%a)"))
-        display_df['start_time_str'] = display_df['start_time'].apply(lambda x: x.strftime("%H:%M"))
-        display_df['end_time_str'] = display_df['end_time'].apply(lambda x: x.strftime("%H:%M"))
+    if len(st.session_state.generated_schedule) > 0:
+        schedule_revision = current_revision(st.session_state, "employees", "timetable", "schedule") + st.session_state.loaded_period
+        display_df = view_cache.get_or_build("schedule_display", schedule_revision, lambda: build_schedule_display(st.session_state.generated_schedule))
         try:
-            schedule_pivot = display_df.pivot_table(index=['date_str', 'shift_name', 'start_time_str', 'end_time_str'], columns='position_index', values='assigned_employee_name', aggfunc='first').reset_index()
-            schedule_pivot = schedule_pivot.rename(columns={'date_str':'日付', 'shift_name':'シフト名', 'start_time_str':'開始', 'end_time_str':'終了'})
-            num_cols = len([col for col in schedule_pivot.columns if isinstance(col, int)])
-            schedule_pivot = schedule_pivot.rename(columns={i: f'担当者{i+1}' for i in range(num_cols)})
+            schedule_pivot = view_cache.get_or_build("schedule_pivot", schedule_revision, lambda: build_schedule_pivot(display_df))
             st.dataframe(schedule_pivot)
-            excel_data = generate_excel(schedule_pivot, st.session_state.employee_summary)
+            schedule_positions, employee_summary = st.session_state.generated_schedule, st.session_state.employee_summary
+            col_export1, col_export2, col_export3 = st.columns(3)
+            export_format = col_export1.selectbox("出力形式", options=list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0], key="export_format_select")
+            export_per_month = col_export2.checkbox("月ごとのシートを追加", key="export_per_month", disabled=export_format != "xlsx")
+            export_per_staff = col_export3.checkbox("スタッフごとのシートを追加", key="export_per_staff", disabled=export_format != "xlsx")
+            export_options = (export_format, export_per_staff, export_per_month)
+            # ファイルはダウンロードボタンが押されたときにだけ作る (同じリビジョン・同じ設定なら使い回す)
             st.download_button(
-                label="Excelファイルとしてダウンロード", 
-                data=excel_data, 
-                file_name=f"shift_schedule_{datetime.date.today().strftime('%Y%m%d')}.xlsx", # 修正箇所
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
+                label=f"{EXPORT_FORMATS[export_format][0]}ファイルとしてダウンロード", 
+                data=lambda: view_cache.get_or_build("schedule_export", schedule_revision + export_options, lambda: export_schedule(schedule_positions, employee_summary, *export_options)), 
+                file_name=f"shift_schedule_{datetime.date.today().strftime('%Y%m%d')}.{export_format}", # 修正箇所
+                mime=EXPORT_FORMATS[export_format][1], 
                 key="download_excel_btn"
             )
         except Exception as e:
@@ -0,0 +1,150 @@
+import argparse
+import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from shift_engine import generate_schedule
+from shift_export import write_csv, write_excel, write_parquet
+from shift_import import parse_roster, parse_timetable, read_roster
+from shift_template import RecurringTimetable, rules_from_config
+
+# --- 複数教室・複数期間のシフト一括生成 (ブラウザ不要) ---
+#   python shift_batch.py sites/ --month 2025-05 --output out/
+# sites/ の下に教室ごとのディレクトリを置き、それぞれに
+#   roster.csv / roster.xlsx       スタッフと勤務可能日 (アプリの一括登録と同じ形式)
+#   timetable.csv / timetable.xlsx 日付・シフト名・開始・終了・必要人数 (省略時は毎週の既定シフト枠)
+# を入れる。教室 × 期間ごとに 1 ジョブとしてプロセスプールで並列に生成し、
+# out/<教室>/<期間>/ にシフト表と summary.csv を書き出す。
+
+ROSTER_NAMES = ("roster.csv", "roster.xlsx")
+TIMETABLE_NAMES = ("timetable.csv", "timetable.xlsx")
+EXPORT_WRITERS = {"xlsx": "schedule.xlsx", "csv": "schedule.csv", "parquet": "schedule.parquet"}
+
+
+def _find_file(site_dir, names):
+    return next((site_dir / name for name in names if (site_dir / name).is_file()), None)
+
+
+def month_period(month_str):
+    """"YYYY-MM" をその月の (初日, 末日) にする。"""
+    first = datetime.datetime.strptime(month_str, "%Y-%m").date()
+    next_month = (first.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return first, next_month - datetime.timedelta(days=1)
+
+
+def _month_arg(value):
+    try:
+        return month_period(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' は YYYY-MM の形式で指定してください。")
+
+
+def _period_arg(value):
+    try:
+        period_start, period_end = (datetime.date.fromisoformat(d) for d in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' は YYYY-MM-DD:YYYY-MM-DD の形式で指定してください。")
+    if period_start > period_end:
+        raise argparse.ArgumentTypeError(f"'{value}' は開始日が終了日より後です。")
+    return period_start, period_end
+
+
+def run_job(site_dir, period_start, period_end, output_dir, mode="greedy", time_limit=30.0, formats=("xlsx",)):
+    """1 教室 × 1 期間のシフトを生成して書き出し、結果の dict を返す (プロセスプールのワーカーで実行)。"""
+    site_dir, output_dir = Path(site_dir), Path(output_dir)
+    result = {'site': site_dir.name, 'period': f"{period_start.isoformat()}_{period_end.isoformat()}", 'errors': [], 'warnings': []}
+    started = time.perf_counter()
+    roster_path = _find_file(site_dir, ROSTER_NAMES)
+    if roster_path is None:
+        result['errors'].append(f"{' / '.join(ROSTER_NAMES)} がありません。")
+        return result
+    timetable_path = _find_file(site_dir, TIMETABLE_NAMES)
+    try:
+        employees, errors = parse_roster(read_roster(roster_path, roster_path.name), period_start, period_end, ignore_out_of_period=True)
+        if timetable_path is not None:
+            timetable, timetable_errors = parse_timetable(read_roster(timetable_path, timetable_path.name), period_start, period_end)
+            errors += timetable_errors
+    except Exception as e:
+        # 壊れたファイルなどはこのジョブだけのエラーにして、他のジョブは続ける
+        result['errors'].append(f"ファイルを読み込めませんでした: {e}")
+        return result
+    if timetable_path is None:
+        rules, missing_presets = rules_from_config()
+        timetable = RecurringTimetable(rules, period_start, period_end)
+        result['warnings'] += [f"既定シフト枠のプリセット '{name}' が見つかりません。" for name in missing_presets]
+    if errors:
+        result['errors'] += errors
+        return result
+    try:
+        try:
+            all_positions, summary_data = generate_schedule(employees, timetable, period_start, period_end, mode=mode, time_limit=time_limit)
+        except (TimeoutError, RuntimeError) as e:
+            result['warnings'].append(f"{e} 高速 (貪欲法) で生成します。")
+            all_positions, summary_data = generate_schedule(employees, timetable, period_start, period_end)
+    except Exception as e:
+        result['errors'].append(f"シフトを生成できませんでした: {e}")
+        return result
+
+    job_dir = output_dir / site_dir.name / result['period']
+    try:
+        job_dir.mkdir(parents=True, exist_ok=True)
+        for export_format in formats:
+            with open(job_dir / EXPORT_WRITERS[export_format], "wb") as f:
+                if export_format == "xlsx": write_excel(all_positions, summary_data, f)
+                elif export_format == "csv": write_csv(all_positions, f)
+                else: write_parquet(all_positions, f)
+        pd.DataFrame(summary_data).to_csv(job_dir / "summary.csv", index=False, encoding="utf-8-sig")
+    except Exception as e:
+        # 書き込めない出力先や pyarrow がない場合など
+        result['errors'].append(f"{job_dir} に書き出せませんでした: {e}")
+        return result
+    result.update({'staff': len(employees), 'positions': len(all_positions), 'assigned': all_positions.assigned_count(), 'seconds': round(time.perf_counter() - started, 3), 'output': str(job_dir)})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数教室・複数期間のシフトを一括生成する")
+    parser.add_argument("sites_dir", help="教室ごとのディレクトリを含むディレクトリ")
+    parser.add_argument("--month", type=_month_arg, action="append", default=[], help="対象月 (YYYY-MM)。複数指定可")
+    parser.add_argument("--period", type=_period_arg, action="append", default=[], help="対象期間 (YYYY-MM-DD:YYYY-MM-DD)。複数指定可")
+    parser.add_argument("--output", default="output", help="出力先ディレクトリ")
+    parser.add_argument("--mode", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--time-limit", type=float, default=30.0, help="optimal の制限時間 (秒)")
+    parser.add_argument("--format", dest="formats", nargs="+", choices=list(EXPORT_WRITERS), default=["xlsx"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="並列プロセス数 (既定: CPU コア数)")
+    args = parser.parse_args(argv)
+
+    periods = args.month + args.period
+    if not periods:
+        parser.error("--month か --period を 1 つ以上指定してください。")
+    site_dirs = sorted(p for p in Path(args.sites_dir).iterdir() if p.is_dir())
+    if not site_dirs:
+        parser.error(f"{args.sites_dir} に教室のディレクトリがありません。")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(run_job, site_dir, start, end, args.output, args.mode, args.time_limit, args.formats): (site_dir, start, end) for site_dir in site_dirs for start, end in periods}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # ワーカーのプロセスが落ちた場合なども、このジョブだけの失敗として残りの結果を表示する
+                site_dir, start, end = futures[future]
+                result = {'site': site_dir.name, 'period': f"{start.isoformat()}_{end.isoformat()}", 'errors': [f"ジョブが異常終了しました: {e!r}"], 'warnings': []}
+            label = f"{result['site']} {result['period']}"
+            for message in result['warnings']: print(f"[警告] {label}: {message}")
+            if result['errors']:
+                failed += 1
+                for message in result['errors']: print(f"[エラー] {label}: {message}")
+            else:
+                print(f"{label}: {result['assigned']}/{result['positions']} 枠を割当 ({result['staff']}人, {result['seconds']}秒) → {result['output']}")
+    print(f"{len(futures) - failed}/{len(futures)} 件のジョブが完了しました。")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+import argparse
+import datetime
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from shift_engine import SHIFT_PRESETS, assign_greedy, assign_greedy_reference, assign_optimal, build_positions
+
+# --- シフト生成のベンチマーク ---
+# アプリと同じ形の employees / timetable を合成し、生成方法ごとに
+# 実行時間・ピークメモリ・充足率を測って JSON に書き出す。
+# 1日の上限シフト数なし (アプリ・一括生成の既定) と、従来の実装 (reference) と同じ
+# 全員 max_daily_shifts=1 の両方で測る。reference は max_daily_shifts=1 の行だけ。
+#   python shift_bench.py --staff 10 100 1000 5000 --days 7 31 90 365 --output bench_results.json
+#   python shift_bench.py --max-daily-shifts none  (上限なしだけを測る)
+#   python shift_bench.py --verify      (従来の実装との結果の一致を確かめる)
+
+DEFAULT_STAFF_COUNTS = [10, 100, 1000, 5000]
+DEFAULT_DAY_COUNTS = [7, 31, 90, 365]
+VARIANTS = ["greedy", "optimal", "reference"]
+DEFAULT_DAILY_CAPS = [None, 1]  # 測定する max_daily_shifts (None は上限なし)
+
+
+def make_workload(n_staff, n_days, seed=0, availability=0.5, period_start=datetime.date(2025, 4, 1)):
+    """合成データ (employees, timetable, 期間開始日, 期間終了日) を作る。同じ引数なら同じデータ。"""
+    rng = random.Random(f"{seed}-{n_staff}-{n_days}")
+    dates = [period_start + datetime.timedelta(days=x) for x in range(n_days)]
+    timetable = {}
+    for date_val in dates:
+        presets = rng.sample(SHIFT_PRESETS, rng.randint(1, 2))
+        timetable[date_val] = [{'id': f"{date_val.isoformat()}-{k}", 'name': p["name"], 'start_time': p["start_time"], 'end_time': p["end_time"], 'required_people': rng.randint(1, 5)} for k, p in enumerate(presets)]
+    employees = []
+    for i in range(n_staff):
+        available_dates = [d for d in dates if rng.random() < availability]
+        employees.append({'id': f"emp-{i:05d}", 'name': f"スタッフ{i + 1}", 'desired_shifts': rng.randint(0, max(1, len(available_dates) // 2)), 'available_dates': available_dates})
+    return employees, timetable, dates[0], dates[-1]
+
+
+def one_shift_per_day(employees):
+    """全員に max_daily_shifts=1 を設定したコピー (従来の実装と同じ「1人1日1シフト」の条件)。"""
+    return with_daily_cap(employees, 1)
+
+
+def with_daily_cap(employees, max_daily_shifts):
+    """全員の max_daily_shifts を設定したコピー。None ならそのまま返す。"""
+    if max_daily_shifts is None:
+        return employees
+    return [{**emp, 'max_daily_shifts': max_daily_shifts} for emp in employees]
+
+
+def _daily_cap_arg(value):
+    if value.lower() == "none":
+        return None
+    try:
+        cap = int(value)
+    except ValueError:
+        cap = 0
+    if cap < 1:
+        raise argparse.ArgumentTypeError(f"'{value}' は 1 以上の整数か none で指定してください。")
+    return cap
+
+
+def verify_reference(n_cases=200, seed=0, log=print):
+    """小さな合成データで assign_greedy と assign_greedy_reference の結果が一致するか確かめ、不一致のケース数を返す。
+
+    従来の実装は 1人1日1シフトなので、両方とも one_shift_per_day の従業員で比べる。
+    """
+    rng = random.Random(seed)
+    mismatches = 0
+    for case in range(n_cases):
+        employees, timetable, period_start, period_end = make_workload(rng.randint(1, 15), rng.randint(1, 21), seed=f"{seed}-{case}", availability=rng.random())
+        employees = one_shift_per_day(employees)
+        greedy_positions = build_positions(timetable, period_start, period_end)
+        reference_positions = build_positions(timetable, period_start, period_end)
+        greedy_shifts = assign_greedy(employees, greedy_positions)
+        reference_shifts = assign_greedy_reference(employees, reference_positions)
+        if greedy_positions.assigned_ids != reference_positions.assigned_ids or greedy_shifts != reference_shifts:
+            mismatches += 1
+            log(f"不一致: case={case} staff={len(employees)} positions={len(greedy_positions)}")
+    log(f"{n_cases - mismatches}/{n_cases} ケースで assign_greedy と従来の実装の結果が一致しました。")
+    return mismatches
+
+
+def run_variant(variant, employees, timetable, period_start, period_end, time_limit, measure_memory):
+    positions = build_positions(timetable, period_start, period_end)
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    error = None
+    try:
+        if variant == "optimal":
+            actual_shifts = assign_optimal(employees, positions, time_limit=time_limit)
+        elif variant == "reference":
+            actual_shifts = assign_greedy_reference(employees, positions)
+        else:
+            actual_shifts = assign_greedy(employees, positions)
+        status = "ok"
+    except TimeoutError:
+        actual_shifts, status = None, "timeout"
+    except RuntimeError as e:
+        actual_shifts, status, error = None, "error", str(e)
+    wall_time = time.perf_counter() - started
+    peak_memory = None
+    if measure_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    assigned = positions.assigned_count()
+    result = {'status': status, 'wall_time_s': round(wall_time, 6), 'peak_memory_bytes': peak_memory, 'positions': len(positions), 'assigned': assigned, 'coverage': round(assigned / len(positions), 6) if positions else 1.0}
+    if error is not None:
+        result['error'] = error
+    if actual_shifts is not None:
+        result['squared_deviation'] = sum((actual_shifts[emp['id']] - emp['desired_shifts']) ** 2 for emp in employees)
+    return result
+
+
+def run_benchmark(staff_counts, day_counts, variants, seed=0, time_limit=60.0, reference_limit=2_000_000, measure_memory=True, daily_caps=DEFAULT_DAILY_CAPS, log=print):
+    """全組み合わせを測定して結果の dict のリストを返す。
+
+    daily_caps の max_daily_shifts (None は上限なし) ごとに全員の設定を変えて測り、行に記録する。
+    reference (従来の総当たり実装) は 1人1日1シフトしか扱えないので max_daily_shifts=1 のときだけ測り、
+    従業員数 × ポジション数² が reference_limit を超えると測らない。
+    """
+    if "optimal" in variants:
+        # SciPy の import 時間を最初の測定に含めない
+        import scipy.optimize, scipy.sparse  # noqa: F401
+    results = []
+    for n_staff in staff_counts:
+        for n_days in day_counts:
+            workload, timetable, period_start, period_end = make_workload(n_staff, n_days, seed=seed)
+            n_positions = sum(slot['required_people'] for slots in timetable.values() for slot in slots)
+            for max_daily_shifts in daily_caps:
+                employees = with_daily_cap(workload, max_daily_shifts)
+                for variant in variants:
+                    if variant == "reference" and max_daily_shifts != 1:
+                        continue
+                    row = {'variant': variant, 'staff': n_staff, 'days': n_days, 'seed': seed, 'max_daily_shifts': max_daily_shifts}
+                    if variant == "reference" and n_staff * n_positions ** 2 > reference_limit:
+                        row.update({'status': "skipped", 'positions': n_positions})
+                    else:
+                        row.update(run_variant(variant, employees, timetable, period_start, period_end, time_limit, measure_memory))
+                    results.append(row)
+                    log(f"{variant:>9} staff={n_staff:<5} days={n_days:<3} cap={max_daily_shifts or '-':<2} {row['status']:>7} {row.get('wall_time_s', '-')}s coverage={row.get('coverage', '-')}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シフト生成のベンチマーク")
+    parser.add_argument("--staff", type=int, nargs="+", default=DEFAULT_STAFF_COUNTS, help="スタッフ数 (複数指定可)")
+    parser.add_argument("--days", type=int, nargs="+", default=DEFAULT_DAY_COUNTS, help="期間の日数 (複数指定可)")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=VARIANTS, help="測定する生成方法")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-limit", type=float, default=60.0, help="optimal の制限時間 (秒)")
+    parser.add_argument("--reference-limit", type=float, default=2_000_000, help="reference を測る 従業員数×ポジション数² の上限")
+    parser.add_argument("--max-daily-shifts", dest="daily_caps", type=_daily_cap_arg, nargs="+", default=DEFAULT_DAILY_CAPS, metavar="N", help="全員に設定する1日の上限シフト数 (none は上限なし、複数指定可。既定: none 1)")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc によるピークメモリ測定を省く (その分速い)")
+    parser.add_argument("--output", default="bench_results.json", help="結果の出力先 (JSON)")
+    parser.add_argument("--verify", type=int, nargs="?", const=200, metavar="N", help="測定の代わりに N ケース (既定 200) で従来の実装との結果の一致を確かめる")
+    args = parser.parse_args(argv)
+    if args.verify is not None:
+        return 1 if verify_reference(args.verify, seed=args.seed) else 0
+    results = run_benchmark(args.staff, args.days, args.variants, seed=args.seed, time_limit=args.time_limit, reference_limit=args.reference_limit, measure_memory=not args.no_memory, daily_caps=args.daily_caps)
+    report = {'created_at': datetime.datetime.now().isoformat(timespec="seconds"), 'python': platform.python_version(), 'platform': platform.platform(), 'results': results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を {args.output} に書き出しました。")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+
+# --- 派生データのキャッシュ ---
+# employees / timetable / schedule のリビジョン (ShiftStore が書き込みごとに進める) を
+# state["data_revision"] に持ち、一覧表・ピボット・Excel などの派生データは
+# (名前, リビジョン) をキーに使い回す。
+
+REVISION_KINDS = ("employees", "timetable", "schedule")
+
+
+def current_revision(state, *kinds):
+    """キャッシュのキーに使うリビジョン番号のタプルを返す。"""
+    revisions = state.setdefault("data_revision", dict.fromkeys(REVISION_KINDS, 0))
+    return tuple(revisions[kind] for kind in kinds)
+
+
+class RevisionCache:
+    """(名前, リビジョン) ごとに計算結果を保持する LRU キャッシュ。max_entries を超えたら古いものから捨てる。
+
+    st.download_button の data に渡す関数は別スレッドで呼ばれるのでロックで守る。
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, name, revision, builder):
+        key = (name, revision)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = builder()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
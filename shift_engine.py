@@ -0,0 +1,519 @@
+import datetime
+import heapq
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from collections.abc import Mapping
+from itertools import repeat
+
+# --- シフト自動生成エンジン ---
+# Streamlit に依存しないため、アプリ以外 (検証スクリプト等) からも import できる。
+
+UNASSIGNED_NAME = "未割当"
+
+# --- シフトプリセットの定義 ---
+SHIFT_PRESETS = [
+    {"name": "中学生自習対応・マナビス (16時半開始)", "start_time": datetime.time(16, 30), "end_time": datetime.time(21, 40)},
+    {"name": "小5ONLINE英語のサポート/中学生自習対応・マナビス", "start_time": datetime.time(18, 0), "end_time": datetime.time(21, 40)},
+    {"name": "中学生自習対応・マナビス (18時開始)", "start_time": datetime.time(18, 0), "end_time": datetime.time(21, 40)},
+    {"name": "速読・自習室巡回(土曜午前)", "start_time": datetime.time(9, 0), "end_time": datetime.time(12, 30)},
+    {"name": "自習対応・マナビス(土曜午後)", "start_time": datetime.time(15, 30), "end_time": datetime.time(21, 0)},
+    {"name": "中学生自習対応・マナビス (日曜昼)", "start_time": datetime.time(13, 30), "end_time": datetime.time(18, 0)},
+]
+
+# --- 曜日ごとの既定シフト枠 (曜日 → [(プリセット名, 必要人数)]) ---
+DEFAULT_SHIFTS_CONFIG = {
+    0: [("中学生自習対応・マナビス (18時開始)", 1)], 1: [("中学生自習対応・マナビス (18時開始)", 1)],
+    2: [("中学生自習対応・マナビス (16時半開始)", 1)], 3: [("小5ONLINE英語のサポート/中学生自習対応・マナビス", 1)],
+    4: [("中学生自習対応・マナビス (18時開始)", 1)],
+    5: [("速読・自習室巡回(土曜午前)", 1), ("自習対応・マナビス(土曜午後)", 1)],
+    6: [("中学生自習対応・マナビス (日曜昼)", 1)]
+}
+
+# --- スタッフごとの勤務条件 (従業員の dict の任意キー → 表示名)。未設定 (None) なら制限なし ---
+STAFF_LIMITS = {
+    'max_daily_shifts': "1日の上限シフト数",
+    'max_daily_hours': "1日の上限時間",
+    'max_weekly_hours': "週の上限時間",
+    'min_rest_hours': "勤務間隔(時間)",
+}
+
+
+POSITION_FIELDS = ("date", "shift_id", "shift_name", "start_time", "end_time", "position_index", "assigned_employee_id", "assigned_employee_name")
+
+
+class PositionTable:
+    """ポジション (1人分の枠) の一覧を列ごとの配列で持つ。
+
+    日付・シフト枠ID・シフト名・時刻はシフト枠ごとに 1 つだけ持ち、ポジションごとには
+    枠番号・担当番号・担当者ID・担当者名だけを持つ。枠 s のポジションは
+    slot_first[s] 〜 slot_first[s + 1] - 1 番に並ぶ。
+    positions[i] は従来のポジションの dict と同じキーで読み書きできるビューを返す。
+    """
+
+    def __init__(self):
+        self.slot_date, self.slot_id, self.slot_name, self.slot_start, self.slot_end = [], [], [], [], []
+        self.slot_first = array('i', [0])
+        self.pos_slot, self.pos_index = array('i'), array('i')
+        self.assigned_ids, self.assigned_names = [], []
+        self._slot_columns = {'date': self.slot_date, 'shift_id': self.slot_id, 'shift_name': self.slot_name, 'start_time': self.slot_start, 'end_time': self.slot_end}
+        self._position_columns = {'position_index': self.pos_index, 'assigned_employee_id': self.assigned_ids, 'assigned_employee_name': self.assigned_names}
+
+    def add_slot(self, date_val, shift_slot):
+        """シフト枠を 1 つ追加し、必要人数分の未割当ポジションを並べる。"""
+        slot, n = len(self.slot_id), shift_slot['required_people']
+        self.slot_date.append(date_val); self.slot_id.append(shift_slot['id']); self.slot_name.append(shift_slot['name'])
+        self.slot_start.append(shift_slot['start_time']); self.slot_end.append(shift_slot['end_time'])
+        self.pos_slot.extend(repeat(slot, n))
+        self.pos_index.extend(range(n))
+        self.assigned_ids.extend(repeat(None, n))
+        self.assigned_names.extend(repeat(UNASSIGNED_NAME, n))
+        self.slot_first.append(len(self.pos_slot))
+
+    @property
+    def n_slots(self):
+        return len(self.slot_id)
+
+    def slot_positions(self, slot):
+        return range(self.slot_first[slot], self.slot_first[slot + 1])
+
+    def __len__(self):
+        return len(self.pos_slot)
+
+    def __getitem__(self, idx):
+        # スライスは従来のリストと同じくポジション (ビュー) のリストを返す
+        if isinstance(idx, slice):
+            return [PositionView(self, i) for i in range(len(self))[idx]]
+        return PositionView(self, range(len(self))[idx])
+
+    def __iter__(self):
+        return (PositionView(self, idx) for idx in range(len(self)))
+
+    def value(self, idx, field):
+        if field in self._slot_columns:
+            return self._slot_columns[field][self.pos_slot[idx]]
+        return self._position_columns[field][idx]
+
+    def column(self, field, start=0, stop=None):
+        """1 列分をポジションごとのリストにして返す (start〜stop 番のみ)。"""
+        if field in self._slot_columns:
+            values = self._slot_columns[field]
+            return [values[slot] for slot in self.pos_slot[start:stop]]
+        return list(self._position_columns[field][start:stop])
+
+    def columns(self):
+        """{列名: リスト} の形 (pd.DataFrame にそのまま渡せる)。"""
+        return {field: self.column(field) for field in POSITION_FIELDS}
+
+    def assign(self, idx, emp_id, emp_name):
+        self.assigned_ids[idx] = emp_id
+        self.assigned_names[idx] = emp_name
+
+    def assigned_count(self):
+        return len(self.assigned_ids) - self.assigned_ids.count(None)
+
+    def iter_assignments(self):
+        """割当済みのポジションごとに (日付, シフト枠ID, 担当番号, 担当者ID) を返す。"""
+        for idx, emp_id in enumerate(self.assigned_ids):
+            if emp_id is not None:
+                slot = self.pos_slot[idx]
+                yield self.slot_date[slot], self.slot_id[slot], self.pos_index[idx], emp_id
+
+
+class PositionView(Mapping):
+    """PositionTable の 1 行分。担当者ID・担当者名だけは代入できる。"""
+
+    __slots__ = ("table", "idx")
+
+    def __init__(self, table, idx):
+        self.table, self.idx = table, idx
+
+    def __getitem__(self, field):
+        return self.table.value(self.idx, field)
+
+    def __setitem__(self, field, value):
+        if field not in ('assigned_employee_id', 'assigned_employee_name'):
+            raise KeyError(field)
+        self.table._position_columns[field][self.idx] = value
+
+    def __iter__(self):
+        return iter(POSITION_FIELDS)
+
+    def __len__(self):
+        return len(POSITION_FIELDS)
+
+
+def build_positions(timetable, period_start, period_end):
+    """タイムテーブルを必要人数分のポジション (1人分の枠) に展開する。日付昇順・枠の登録順。"""
+    positions = PositionTable()
+    for date_val in sorted(d for d in timetable.keys() if period_start <= d <= period_end):
+        for shift_slot in timetable[date_val]:
+            positions.add_slot(date_val, shift_slot)
+    return positions
+
+
+def shift_minutes(date_val, start_time, end_time):
+    """シフトの時間帯を (開始, 終了) の通算分に直す。終了が開始以前なら日付をまたぐとみなす。"""
+    day = date_val.toordinal() * 1440
+    start = day + start_time.hour * 60 + start_time.minute
+    end = day + end_time.hour * 60 + end_time.minute
+    return start, end if end > start else end + 1440
+
+
+def week_of(date_val):
+    """月曜始まりの週番号。"""
+    return (date_val.toordinal() - 1) // 7
+
+
+def _hours_to_minutes(hours):
+    return None if hours is None else round(hours * 60)
+
+
+class StaffCalendar:
+    """1人分の割当済みの時間帯と、日・週ごとのシフト数・勤務時間 (分)。
+
+    上限は従業員の dict の STAFF_LIMITS のキーで、未設定 (None) なら制限なし:
+    max_daily_shifts (1日のシフト数), max_daily_hours / max_weekly_hours (1日・1週の勤務時間),
+    min_rest_hours (シフトとシフトの間に空ける時間)。
+    時間帯は開始順の配列に持つので、重なり (勤務間隔を含む) の判定は二分探索で済む。
+    """
+
+    __slots__ = ("rest", "max_daily_shifts", "max_daily_minutes", "max_weekly_minutes", "starts", "ends", "daily_shifts", "daily_minutes", "weekly_minutes")
+
+    def __init__(self, emp):
+        self.rest = _hours_to_minutes(emp.get('min_rest_hours')) or 0
+        self.max_daily_shifts = emp.get('max_daily_shifts')
+        self.max_daily_minutes = _hours_to_minutes(emp.get('max_daily_hours'))
+        self.max_weekly_minutes = _hours_to_minutes(emp.get('max_weekly_hours'))
+        self.starts, self.ends = [], []
+        self.daily_shifts, self.daily_minutes, self.weekly_minutes = defaultdict(int), defaultdict(int), defaultdict(int)
+
+    def fits(self, date_val, start, end):
+        """date_val の start〜end (通算分) のシフトを追加しても上限・勤務間隔を守れるか。"""
+        if self.max_daily_shifts is not None and self.daily_shifts[date_val] >= self.max_daily_shifts:
+            return False
+        if self.max_daily_minutes is not None and self.daily_minutes[date_val] + end - start > self.max_daily_minutes:
+            return False
+        if self.max_weekly_minutes is not None and self.weekly_minutes[week_of(date_val)] + end - start > self.max_weekly_minutes:
+            return False
+        starts = self.starts
+        i = bisect_left(starts, start)
+        if i < len(starts) and starts[i] < end + self.rest:
+            return False
+        return i == 0 or self.ends[i - 1] + self.rest <= start
+
+    def add(self, date_val, start, end):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.daily_shifts[date_val] += 1
+        self.daily_minutes[date_val] += end - start
+        self.weekly_minutes[week_of(date_val)] += end - start
+
+
+def _collect_open_slots(employees_map, positions):
+    """割当済みのポジションを各従業員のカレンダーに載せ、空きポジションをシフト枠ごとにまとめる。
+
+    (カレンダー, 実績シフト数, 枠→空きポジション番号のリスト, 枠→(日付, 開始, 終了), 日付→枠番号のリスト) を返す。
+    枠番号は空きのある枠だけに、ポジションの並び (日付順・枠の登録順) で振り直す。
+    """
+    calendars = {emp_id: StaffCalendar(emp) for emp_id, emp in employees_map.items()}
+    actual_shifts = dict.fromkeys(employees_map, 0)
+    slot_open, slot_times, slots_by_date = [], [], defaultdict(list)
+    assigned_ids = positions.assigned_ids
+    for table_slot in range(positions.n_slots):
+        date_val = positions.slot_date[table_slot]
+        interval = shift_minutes(date_val, positions.slot_start[table_slot], positions.slot_end[table_slot])
+        open_in_slot = []
+        for idx in positions.slot_positions(table_slot):
+            emp_id = assigned_ids[idx]
+            if emp_id is None:
+                open_in_slot.append(idx)
+            elif emp_id in actual_shifts:
+                actual_shifts[emp_id] += 1
+                calendars[emp_id].add(date_val, *interval)
+        if open_in_slot:
+            slots_by_date[date_val].append(len(slot_open))
+            slot_open.append(open_in_slot)
+            slot_times.append((date_val,) + interval)
+    return calendars, actual_shifts, slot_open, slot_times, slots_by_date
+
+
+def assign_greedy(employees, positions):
+    """未割当のポジションを貪欲法で埋める (positions を直接更新し、従業員ID→実績シフト数を返す)。
+
+    選択規則は従来の実装と同じ:
+    need_score (希望数 - 実績数) が最大の従業員 (同点ならスタッフリストの登録順) に、
+    その人が入れる最も若いポジションを割り当てる。
+    入れるかどうかは StaffCalendar で判定する (時間帯が重ならなければ同じ日に複数のシフトも可)。
+
+    need_score をキーにしたヒープと、従業員ごとの候補シフト枠へのポインタを使う。
+    割当は増える一方なので、一度入れなかった枠には以後も入れず、ポインタは戻らない。
+    割当済みのポジションは実績として引き継ぐ。
+    """
+    employees_map = {emp['id']: emp for emp in employees}
+    calendars, actual_shifts, slot_open, slot_times, slots_by_date = _collect_open_slots(employees_map, positions)
+    # 各シフト枠の空きポジションは若い順にしか埋まらないので、先頭位置だけを持てばよい
+    slot_cursor = [0] * len(slot_open)
+
+    emp_ids = list(employees_map)
+    candidate_slots, slot_pointer, heap = [], [], []
+    for rank, emp_id in enumerate(emp_ids):
+        emp = employees_map[emp_id]
+        candidate_slots.append([slot for d in sorted(set(emp['available_dates'])) if d in slots_by_date for slot in slots_by_date[d]])
+        slot_pointer.append(0)
+        heap.append((actual_shifts[emp_id] - emp['desired_shifts'], rank))
+    heapq.heapify(heap)
+
+    while heap:
+        neg_need_score, rank = heap[0]
+        slots, pointer = candidate_slots[rank], slot_pointer[rank]
+        calendar = calendars[emp_ids[rank]]
+        while pointer < len(slots) and (slot_cursor[slots[pointer]] >= len(slot_open[slots[pointer]]) or not calendar.fits(*slot_times[slots[pointer]])):
+            pointer += 1
+        if pointer >= len(slots):
+            # 割当を重ねても入れる枠は増えないので、この従業員は以後候補から外す
+            heapq.heappop(heap)
+            continue
+        slot = slots[pointer]
+        slot_pointer[rank] = pointer + 1  # 同じ枠にはもう入れない
+        pos_idx = slot_open[slot][slot_cursor[slot]]
+        slot_cursor[slot] += 1
+        emp_id = emp_ids[rank]
+        positions.assign(pos_idx, emp_id, employees_map[emp_id]['name'])
+        calendar.add(*slot_times[slot])
+        actual_shifts[emp_id] += 1
+        heapq.heapreplace(heap, (neg_need_score + 1, rank))
+    return actual_shifts
+
+
+def assign_greedy_reference(employees, positions):
+    """従来の総当たり実装 (O(従業員数 × ポジション数²))。1人1日1シフトまで。
+
+    全従業員に max_daily_shifts=1 を設定した assign_greedy と同じ結果になる (照合用)。
+    """
+    employees_map = {emp['id']: emp.copy() for emp in employees}
+    for emp_id in employees_map: employees_map[emp_id]['actual_shifts'] = 0
+    daily_assignment_tracker = defaultdict(lambda: defaultdict(bool))
+    MAX_ITERATIONS = len(positions) * 2
+    for iteration in range(MAX_ITERATIONS):
+        unassigned_indices = [idx for idx, pos in enumerate(positions) if pos['assigned_employee_id'] is None]
+        if not unassigned_indices: break
+        possible_assignments = []
+        for emp_id, emp_details in employees_map.items():
+            need_score = emp_details['desired_shifts'] - emp_details['actual_shifts']
+            for pos_idx in unassigned_indices:
+                current_pos = positions[pos_idx]
+                if current_pos['date'] in emp_details['available_dates'] and not daily_assignment_tracker[emp_id][current_pos['date']]:
+                    possible_assignments.append({'emp_id': emp_id, 'pos_idx': pos_idx, 'need_score': need_score})
+        if not possible_assignments: break
+        possible_assignments.sort(key=lambda x: x['need_score'], reverse=True)
+        best_assign_info = possible_assignments[0]
+        assigned_emp_id, assigned_pos_idx = best_assign_info['emp_id'], best_assign_info['pos_idx']
+        positions[assigned_pos_idx]['assigned_employee_id'] = assigned_emp_id
+        positions[assigned_pos_idx]['assigned_employee_name'] = employees_map[assigned_emp_id]['name']
+        employees_map[assigned_emp_id]['actual_shifts'] += 1
+        daily_assignment_tracker[assigned_emp_id][positions[assigned_pos_idx]['date']] = True
+    return {emp_id: emp['actual_shifts'] for emp_id, emp in employees_map.items()}
+
+
+def _conflict_cliques(intervals, rest):
+    """(開始, 終了, 変数番号) のリストから、勤務間隔 rest を含めて互いに重なる組 (区間グラフの極大クリーク) を返す。"""
+    cliques, active, grown = [], [], False
+    for start, end, col in sorted(intervals):
+        if active and active[0][0] <= start:
+            if grown and len(active) >= 2:
+                cliques.append([c for _, c in active])
+            grown = False
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+        heapq.heappush(active, (end + rest, col))
+        grown = True
+    if grown and len(active) >= 2:
+        cliques.append([c for _, c in active])
+    return cliques
+
+
+def assign_optimal(employees, positions, time_limit=30.0):
+    """未割当のポジションを整数計画で一括に埋める (positions を直接更新し、従業員ID→実績シフト数を返す)。
+
+    変数 x は (従業員, シフト枠) の組ごとに 1 つ。シフト枠の定員に加えて、StaffCalendar と同じ制約
+    (勤務間隔を含めて重なる枠の組ごとに高々 1 つ、1日のシフト数、1日・1週の勤務時間の上限) を置く。
+    まず充足できるポジション数の最大値を求め、その充足数を保ったまま Σ(実績数 - 希望数)² を最小にする。
+    費用が凸なので各従業員の k 本目の割当に限界費用 2(k - 希望数) - 1 を持たせた線形の目的関数になる。
+    行列の組み立てを含めて time_limit 秒以内に解けなければ TimeoutError を送出する。
+    """
+    import numpy as np
+    from scipy.optimize import Bounds, LinearConstraint, linprog, milp
+    from scipy.sparse import coo_matrix, vstack
+
+    deadline = time.monotonic() + time_limit
+    timeout_message = f"最適化が制限時間 ({time_limit}秒) 内に終わりませんでした。"
+    employees_map = {emp['id']: emp for emp in employees}
+    emp_ids = list(employees_map)
+    calendars, actual_shifts, slot_open, slot_times, slots_by_date = _collect_open_slots(employees_map, positions)
+    if not slot_open:
+        return actual_shifts
+
+    # 変数 x: 従業員が入れるシフト枠 (割当済みの時間帯や上限で初めから入れない枠は除く)
+    x_emp, x_slot = [], []
+    row_cols, row_coefs, row_ub = [], [], []
+    for rank, emp_id in enumerate(emp_ids):
+        calendar = calendars[emp_id]
+        first_col = len(x_slot)
+        for d in sorted(set(employees_map[emp_id]['available_dates'])):
+            for slot in slots_by_date.get(d, ()):
+                if calendar.fits(*slot_times[slot]):
+                    x_emp.append(rank)
+                    x_slot.append(slot)
+        emp_cols = range(first_col, len(x_slot))
+        if len(emp_cols) < 2:
+            continue
+        for clique in _conflict_cliques([(slot_times[x_slot[c]][1], slot_times[x_slot[c]][2], c) for c in emp_cols], calendar.rest):
+            row_cols.append(clique); row_coefs.append([1] * len(clique)); row_ub.append(1)
+        cols_by_date, cols_by_week = defaultdict(list), defaultdict(list)
+        for c in emp_cols:
+            cols_by_date[slot_times[x_slot[c]][0]].append(c)
+            cols_by_week[week_of(slot_times[x_slot[c]][0])].append(c)
+        for d, cols in cols_by_date.items():
+            if calendar.max_daily_shifts is not None and len(cols) > calendar.max_daily_shifts - calendar.daily_shifts[d]:
+                row_cols.append(cols); row_coefs.append([1] * len(cols)); row_ub.append(calendar.max_daily_shifts - calendar.daily_shifts[d])
+            minutes = [slot_times[x_slot[c]][2] - slot_times[x_slot[c]][1] for c in cols]
+            if calendar.max_daily_minutes is not None and sum(minutes) > calendar.max_daily_minutes - calendar.daily_minutes[d]:
+                row_cols.append(cols); row_coefs.append(minutes); row_ub.append(calendar.max_daily_minutes - calendar.daily_minutes[d])
+        if calendar.max_weekly_minutes is not None:
+            for week, cols in cols_by_week.items():
+                minutes = [slot_times[x_slot[c]][2] - slot_times[x_slot[c]][1] for c in cols]
+                if sum(minutes) > calendar.max_weekly_minutes - calendar.weekly_minutes[week]:
+                    row_cols.append(cols); row_coefs.append(minutes); row_ub.append(calendar.max_weekly_minutes - calendar.weekly_minutes[week])
+        if time.monotonic() > deadline:
+            raise TimeoutError(timeout_message)
+    if not x_slot:
+        return actual_shifts
+    x_emp = np.array(x_emp, dtype=np.int64)
+    x_slot = np.array(x_slot, dtype=np.int64)
+    n_emp, n_x, n_slot = len(emp_ids), len(x_slot), len(slot_open)
+
+    # 変数 y: 従業員ごとの k 本目の割当 (k = 1..入れる枠の数)。限界費用が k について単調増加するので順に使われる
+    x_per_emp = np.bincount(x_emp, minlength=n_emp)
+    y_k = np.arange(n_x) - np.repeat(np.cumsum(x_per_emp) - x_per_emp, x_per_emp) + 1
+    x_cols, y_cols = np.arange(n_x), n_x + np.arange(n_x)
+    n_var = 2 * n_x
+    # 等式: 従業員ごとに Σx - Σy = 0 (2 段目では充足数の行を加える)
+    a_eq = coo_matrix((np.concatenate((np.ones(n_x), -np.ones(n_x))), (np.concatenate((x_emp, x_emp)), np.concatenate((x_cols, y_cols)))), shape=(n_emp, n_var)).tocsr()
+    b_eq = np.zeros(n_emp)
+    # 不等式: シフト枠の定員 / 重なり・上限の制約
+    extra_rows = np.repeat(np.arange(len(row_cols)), [len(cols) for cols in row_cols])
+    flat = lambda lists, dtype: np.fromiter((v for values in lists for v in values), dtype=dtype, count=len(extra_rows))
+    a_ub = coo_matrix((np.concatenate((np.ones(n_x), flat(row_coefs, np.float64))), (np.concatenate((x_slot, n_slot + extra_rows)), np.concatenate((x_cols, flat(row_cols, np.int64))))), shape=(n_slot + len(row_cols), n_var)).tocsr()
+    b_ub = np.concatenate(([len(open_in_slot) for open_in_slot in slot_open], row_ub)).astype(np.float64)
+
+    def solve(cost, a_eq, b_eq):
+        # 線形緩和の解が整数ならそれを使い (重なりの制約だけなら多くの場合そうなる)、そうでなければ整数計画で解き直す
+        for relax in (True, False):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(timeout_message)
+            if relax:
+                result = linprog(cost, A_ub=a_ub, b_ub=b_ub, A_eq=a_eq, b_eq=b_eq, bounds=(0, 1), method='highs-ds', options={'time_limit': remaining})
+            else:
+                result = milp(cost, constraints=[LinearConstraint(a_eq, b_eq, b_eq), LinearConstraint(a_ub, -np.inf, b_ub)], integrality=np.ones(n_var), bounds=Bounds(0, 1), options={'time_limit': remaining})
+            if result.status == 1:
+                raise TimeoutError(timeout_message)
+            if result.status != 0:
+                raise RuntimeError(f"最適化に失敗しました: {result.message}")
+            if not relax or np.all(np.abs(result.x - np.round(result.x)) < 1e-6):
+                return result
+
+    # 1) 充足できるポジション数の最大値を求める
+    max_coverage = round(-solve(np.concatenate((-np.ones(n_x), np.zeros(n_x))), a_eq, b_eq).fun)
+    if max_coverage == 0:
+        return actual_shifts
+    # 2) 充足数を max_coverage に固定し、希望数との差の二乗和を最小化する
+    desired = np.array([employees_map[emp_id]['desired_shifts'] for emp_id in emp_ids], dtype=np.float64)
+    already = np.array([actual_shifts[emp_id] for emp_id in emp_ids], dtype=np.float64)
+    cost = np.concatenate((np.zeros(n_x), 2 * (already[x_emp] + y_k - desired[x_emp]) - 1))
+    coverage_row = coo_matrix((np.ones(n_x), (np.zeros(n_x, dtype=np.int64), x_cols)), shape=(1, n_var))
+    result = solve(cost, vstack((a_eq, coverage_row)).tocsr(), np.append(b_eq, max_coverage))
+
+    slot_cursor = [0] * n_slot
+    for x in np.flatnonzero(result.x[:n_x] > 0.5):
+        emp_id, slot = emp_ids[x_emp[x]], int(x_slot[x])
+        open_in_slot = slot_open[slot]
+        if slot_cursor[slot] >= len(open_in_slot) or not calendars[emp_id].fits(*slot_times[slot]):
+            continue
+        pos_idx = open_in_slot[slot_cursor[slot]]
+        slot_cursor[slot] += 1
+        positions.assign(pos_idx, emp_id, employees_map[emp_id]['name'])
+        calendars[emp_id].add(*slot_times[slot])
+        actual_shifts[emp_id] += 1
+    return actual_shifts
+
+
+def repair_schedule(employees, timetable, period_start, period_end, previous_positions, changed_employee_ids=(), pin_existing=False):
+    """前回の割当を引き継ぎ、編集の影響を受けたポジションだけを埋め直して (ポジション一覧, 集計行) を返す。
+
+    previous_positions は前回の generated_schedule (PositionTable)。
+    削除されたスタッフや勤務可能日から外れた日の割当、時間帯の重なりや上限 (StaffCalendar) に
+    反するようになった割当は外す。pin_existing が False のときは、
+    changed_employee_ids のスタッフと割当を外された (need_score が変わった) スタッフの割当も
+    いったん外して再配分する。空いたポジションは assign_greedy で埋める。
+    """
+    positions = build_positions(timetable, period_start, period_end)
+    employees_map = {emp['id']: emp for emp in employees}
+    previous_assignment = {(date_val, shift_id, position_index): emp_id for date_val, shift_id, position_index, emp_id in previous_positions.iter_assignments()}
+    available_sets, calendars = {}, {}
+    kept, affected_ids = [], set(changed_employee_ids)
+    for slot in range(positions.n_slots):
+        date_val, shift_id = positions.slot_date[slot], positions.slot_id[slot]
+        interval = shift_minutes(date_val, positions.slot_start[slot], positions.slot_end[slot])
+        for idx in positions.slot_positions(slot):
+            emp_id = previous_assignment.pop((date_val, shift_id, positions.pos_index[idx]), None)
+            if emp_id is None or emp_id not in employees_map:
+                continue
+            if emp_id not in available_sets:
+                available_sets[emp_id] = set(employees_map[emp_id]['available_dates'])
+                calendars[emp_id] = StaffCalendar(employees_map[emp_id])
+            if date_val in available_sets[emp_id] and calendars[emp_id].fits(date_val, *interval):
+                calendars[emp_id].add(date_val, *interval)
+                kept.append((idx, emp_id))
+            else:
+                affected_ids.add(emp_id)
+    # 消えたシフト枠・期間外になった日の割当を持っていたスタッフも need_score が変わる
+    affected_ids.update(emp_id for emp_id in previous_assignment.values() if emp_id in employees_map)
+    for idx, emp_id in kept:
+        if pin_existing or emp_id not in affected_ids:
+            positions.assign(idx, emp_id, employees_map[emp_id]['name'])
+    actual_shifts = assign_greedy(employees, positions)
+    return positions, build_summary(employees, actual_shifts)
+
+
+def count_assignments(employees, positions):
+    """ポジション一覧から従業員ID→実績シフト数を数える。"""
+    actual_shifts = {emp['id']: 0 for emp in employees}
+    for emp_id in positions.assigned_ids:
+        if emp_id in actual_shifts:
+            actual_shifts[emp_id] += 1
+    return actual_shifts
+
+
+def build_summary(employees, actual_shifts):
+    """従業員別集計の行 (DataFrame 化する前の dict のリスト) を作る。"""
+    return [{"スタッフ名": emp['name'], "希望シフト数": emp['desired_shifts'], "実績シフト数": actual_shifts.get(emp['id'], 0), "差": actual_shifts.get(emp['id'], 0) - emp['desired_shifts']} for emp in employees]
+
+
+GENERATION_MODES = {"greedy": assign_greedy, "optimal": assign_optimal}
+
+
+def generate_schedule(employees, timetable, period_start, period_end, mode="greedy", time_limit=30.0):
+    """期間内のタイムテーブルにスタッフを割り当て、(ポジション一覧, 集計行) を返す。
+
+    mode は "greedy" (貪欲法) か "optimal" (整数計画)。time_limit は optimal の制限時間 (秒)。
+    """
+    positions = build_positions(timetable, period_start, period_end)
+    if mode == "optimal":
+        actual_shifts = assign_optimal(employees, positions, time_limit=time_limit)
+    else:
+        actual_shifts = GENERATION_MODES[mode](employees, positions)
+    return positions, build_summary(employees, actual_shifts)
@@ -0,0 +1,116 @@
+import csv
+import io
+from itertools import groupby
+
+from openpyxl import Workbook
+
+from shift_engine import POSITION_FIELDS
+
+# --- シフト表の書き出し ---
+# ポジション一覧 (PositionTable、日付順) から 1 行ずつ組み立てて書き出す。pivot_table は使わず、
+# Excel は write-only モード、CSV / Parquet は逐次書き込みなので、期間が長くなっても
+# 作業用のメモリは 1 日分 (Parquet は 1 バッチ分) で済む。
+
+SCHEDULE_HEADER = ["日付", "シフト名", "開始", "終了"]
+SUMMARY_HEADER = ["スタッフ名", "希望シフト数", "実績シフト数", "差"]
+CSV_HEADER = ["日付", "シフト名", "開始", "終了", "担当番号", "スタッフID", "スタッフ名"]
+PARQUET_BATCH_SIZE = 50_000
+INVALID_SHEET_CHARS = str.maketrans({c: "_" for c in "[]:*?/\\"})
+
+
+def _date_str(date_val):
+    return date_val.strftime("%Y-%m-%d (%a)")
+
+
+def iter_slot_rows(positions, n_columns):
+    """シフト枠ごとに (日付, [日付, シフト名, 開始, 終了, 担当者1, ..., 担当者n]) を返す。並びは日付・開始時刻・シフト名順。"""
+    for date_val, slots in groupby(range(positions.n_slots), key=positions.slot_date.__getitem__):
+        for slot in sorted(slots, key=lambda s: (positions.slot_start[s], positions.slot_name[s])):
+            slot_positions = positions.slot_positions(slot)
+            if not slot_positions:
+                continue
+            assigned = [None] * n_columns
+            for idx in slot_positions:
+                assigned[positions.pos_index[idx]] = positions.assigned_names[idx]
+            yield date_val, [_date_str(date_val), positions.slot_name[slot], positions.slot_start[slot].strftime("%H:%M"), positions.slot_end[slot].strftime("%H:%M")] + assigned
+
+
+def _sheet_title(name, used_titles):
+    title = str(name).translate(INVALID_SHEET_CHARS)[:31] or "Sheet"
+    base, n = title, 2
+    while title in used_titles:
+        suffix = f"({n})"
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used_titles.add(title)
+    return title
+
+
+def write_excel(positions, summary_rows, output, per_staff=False, per_month=False):
+    """シフト表と従業員別集計を xlsx として output (ファイルパスまたはバイナリのファイルオブジェクト) に書き出す。
+
+    per_month なら月ごと、per_staff ならスタッフごとのシートも追加する。
+    シートは 1 枚ずつ閉じながら書くので、開いている一時ファイルは同時に 2 つまで。
+    """
+    n_columns = max(positions.pos_index, default=-1) + 1
+    header = SCHEDULE_HEADER + [f"担当者{i + 1}" for i in range(n_columns)]
+    wb = Workbook(write_only=True)
+    used_titles = set()
+    schedule_ws = wb.create_sheet(_sheet_title("シフト表", used_titles))
+    schedule_ws.append(header)
+    month_ws, current_month = None, None
+    for date_val, row in iter_slot_rows(positions, n_columns):
+        schedule_ws.append(row)
+        if per_month:
+            if (date_val.year, date_val.month) != current_month:
+                if month_ws is not None: month_ws.close()
+                current_month = (date_val.year, date_val.month)
+                month_ws = wb.create_sheet(_sheet_title(date_val.strftime("%Y-%m"), used_titles))
+                month_ws.append(header)
+            month_ws.append(row)
+    if month_ws is not None: month_ws.close()
+    schedule_ws.close()
+
+    summary_ws = wb.create_sheet(_sheet_title("従業員別集計", used_titles))
+    summary_ws.append(SUMMARY_HEADER)
+    for summary in summary_rows:
+        summary_ws.append([summary[col] for col in SUMMARY_HEADER])
+    summary_ws.close()
+
+    if per_staff:
+        # スタッフごとにポジションの番号だけを集め、1 人分ずつシートを書いて閉じる
+        by_staff = {}
+        for idx, emp_id in enumerate(positions.assigned_ids):
+            if emp_id is not None:
+                by_staff.setdefault(emp_id, []).append(idx)
+        for indices in by_staff.values():
+            staff_ws = wb.create_sheet(_sheet_title(positions.assigned_names[indices[0]], used_titles))
+            staff_ws.append(SCHEDULE_HEADER)
+            for idx in indices:
+                slot = positions.pos_slot[idx]
+                staff_ws.append([_date_str(positions.slot_date[slot]), positions.slot_name[slot], positions.slot_start[slot].strftime("%H:%M"), positions.slot_end[slot].strftime("%H:%M")])
+            staff_ws.close()
+    wb.save(output)
+
+
+def write_csv(positions, output):
+    """1 ポジション 1 行の CSV (UTF-8 BOM 付き) をバイナリのファイルオブジェクトに書き出す。"""
+    text = io.TextIOWrapper(output, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(CSV_HEADER)
+    for slot in range(positions.n_slots):
+        slot_columns = [positions.slot_date[slot].isoformat(), positions.slot_name[slot], positions.slot_start[slot].strftime("%H:%M"), positions.slot_end[slot].strftime("%H:%M")]
+        for idx in positions.slot_positions(slot):
+            writer.writerow(slot_columns + [positions.pos_index[idx] + 1, positions.assigned_ids[idx] or "", positions.assigned_names[idx]])
+    text.flush()
+    text.detach()
+
+
+def write_parquet(positions, output, batch_size=PARQUET_BATCH_SIZE):
+    """1 ポジション 1 行の Parquet を batch_size 行ずつ書き出す (pyarrow が必要)。"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("date", pa.date32()), ("shift_id", pa.string()), ("shift_name", pa.string()), ("start_time", pa.time32("s")), ("end_time", pa.time32("s")), ("position_index", pa.int32()), ("employee_id", pa.string()), ("employee_name", pa.string())])
+    with pq.ParquetWriter(output, schema) as writer:
+        for start in range(0, len(positions), batch_size):
+            writer.write_batch(pa.record_batch([positions.column(field, start, start + batch_size) for field in POSITION_FIELDS], schema=schema))
@@ -0,0 +1,156 @@
+import datetime
+import uuid
+
+import pandas as pd
+
+from shift_engine import SHIFT_PRESETS, STAFF_LIMITS
+
+# --- スタッフ・勤務可能日の一括取り込み ---
+# 1 行 1 スタッフ、列は ID (任意)・名前・希望日数・日付 (1 列 1 日) の表を読み込む。
+# 日付列のセルは ○ / 1 / TRUE などなら勤務可能、空欄 / × / 0 / FALSE なら不可。
+# 勤務条件 (1日の上限シフト数・1日/週の上限時間・勤務間隔) の列は任意で、空欄なら制限なし。
+# タイムテーブルは 1 行 1 シフト枠 (日付・シフト名・開始・終了・必要人数) の表。
+
+ID_COLUMNS = ("ID", "id")
+NAME_COLUMNS = ("名前", "スタッフ名", "name")
+DESIRED_COLUMNS = ("希望日数", "希望シフト日数", "desired_shifts")
+AVAILABLE_MARKS = {"○", "◯", "o", "1", "1.0", "true", "yes", "y", "可"}
+UNAVAILABLE_MARKS = {"", "×", "x", "-", "0", "0.0", "false", "no", "n", "不可", "nan"}
+LIMIT_COLUMNS = {key: (label, key) for key, label in STAFF_LIMITS.items()}
+TIMETABLE_COLUMNS = ("日付", "シフト名", "開始", "終了", "必要人数")
+
+
+def read_roster(file, filename):
+    """CSV / XLSX を全セル文字列として読み込む。"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        return pd.read_excel(file, dtype=str, keep_default_na=False)
+    return pd.read_csv(file, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+
+
+def _find_column(columns, candidates):
+    return next((c for c in columns if str(c).strip() in candidates), None)
+
+
+def parse_roster(roster_df, period_start, period_end, existing_employees=(), ignore_out_of_period=False):
+    """読み込んだ表を検証し、(取り込むスタッフのリスト, エラーメッセージのリスト) を返す。
+
+    エラーがあればスタッフのリストは空。既存スタッフとは ID 列、なければ名前で突き合わせる。
+    勤務条件は列があるものだけをキーに持たせる (列がなければ既存スタッフの設定を変えない)。
+    返すスタッフの available_dates は期間内の日付だけ (期間外は呼び出し側でそのまま残す)。
+    期間外の日付列はエラーにするが、ignore_out_of_period なら読み飛ばす。
+    """
+    errors = []
+    id_col = _find_column(roster_df.columns, ID_COLUMNS)
+    name_col = _find_column(roster_df.columns, NAME_COLUMNS)
+    desired_col = _find_column(roster_df.columns, DESIRED_COLUMNS)
+    if name_col is None: errors.append("「名前」列がありません。")
+    if desired_col is None: errors.append("「希望日数」列がありません。")
+    if errors:
+        return [], errors
+
+    limit_cols = {key: col for key, candidates in LIMIT_COLUMNS.items() if (col := _find_column(roster_df.columns, candidates)) is not None}
+    other_cols = [c for c in roster_df.columns if c not in (id_col, name_col, desired_col, *limit_cols.values())]
+    header_dates = pd.to_datetime(pd.Series([str(c).strip() for c in other_cols], dtype=object), errors="coerce", format="mixed")
+    bad_headers = [str(c) for c, d in zip(other_cols, header_dates) if pd.isna(d)]
+    if bad_headers: errors.append(f"日付として読めない列があります: {', '.join(bad_headers)}")
+    date_cols = [c for c, d in zip(other_cols, header_dates) if not pd.isna(d)]
+    col_dates = [d.date() for d in header_dates if not pd.isna(d)]
+    out_of_period = [d.isoformat() for d in col_dates if not period_start <= d <= period_end]
+    if out_of_period and ignore_out_of_period:
+        date_cols = [c for c, d in zip(date_cols, col_dates) if period_start <= d <= period_end]
+        col_dates = [d for d in col_dates if period_start <= d <= period_end]
+    elif out_of_period: errors.append(f"スケジュール期間外の日付列があります: {', '.join(out_of_period)}")
+    if len(set(col_dates)) != len(col_dates): errors.append("同じ日付の列が重複しています。")
+
+    names = roster_df[name_col].astype(str).str.strip()
+    row_labels = pd.Series(range(2, len(roster_df) + 2), index=roster_df.index)  # 見出しを 1 行目とした行番号
+    empty_names = row_labels[names == ""]
+    if not empty_names.empty: errors.append(f"名前が空の行があります (行 {', '.join(map(str, empty_names))})。")
+    duplicated = names[names.duplicated(keep=False) & (names != "")].unique()
+    if len(duplicated): errors.append(f"名前が重複しています: {', '.join(duplicated)}")
+    if id_col is not None:
+        row_ids = roster_df[id_col].astype(str).str.strip()
+        duplicated_ids = row_ids[row_ids.duplicated(keep=False) & (row_ids != "")].unique()
+        if len(duplicated_ids): errors.append(f"ID が重複しています: {', '.join(duplicated_ids)}")
+    desired = pd.to_numeric(roster_df[desired_col].astype(str).str.strip(), errors="coerce")
+    bad_desired = row_labels[desired.isna() | (desired < 0) | (desired % 1 != 0)]
+    if not bad_desired.empty: errors.append(f"希望日数は 0 以上の整数で入力してください (行 {', '.join(map(str, bad_desired))})。")
+    limits = {}
+    for key, col in limit_cols.items():
+        text = roster_df[col].astype(str).str.strip()
+        values = pd.to_numeric(text, errors="coerce")
+        if key == 'max_daily_shifts': invalid_values, rule = values.isna() | (values < 1) | (values % 1 != 0), "1 以上の整数"
+        elif key == 'min_rest_hours': invalid_values, rule = values.isna() | (values < 0), "0 以上の数"
+        else: invalid_values, rule = values.isna() | (values <= 0), "0 より大きい数"
+        invalid = (text != "") & invalid_values
+        if invalid.any(): errors.append(f"「{col}」は{rule}で入力してください (空欄なら制限なし) (行 {', '.join(map(str, row_labels[invalid]))})。")
+        limits[key] = [None if pd.isna(v) else (int(v) if key == 'max_daily_shifts' else float(v)) for v in values]
+
+    marks = roster_df[date_cols].apply(lambda col: col.astype(str).str.strip().str.lower())
+    available = marks.isin(AVAILABLE_MARKS)
+    unknown = ~available & ~marks.isin(UNAVAILABLE_MARKS)
+    if unknown.to_numpy().any():
+        cells = unknown.stack()
+        cells = cells[cells].index[:10]
+        errors.append("勤務可否として読めない値があります: " + ", ".join(f"行 {row_labels[row]} / {col}「{roster_df.at[row, col]}」" for row, col in cells))
+    if errors:
+        return [], errors
+
+    existing_by_id = {emp['id']: emp for emp in existing_employees}
+    existing_by_name = {emp['name']: emp for emp in existing_employees}
+    ids = roster_df[id_col].astype(str).str.strip() if id_col is not None else pd.Series("", index=roster_df.index)
+    date_array = pd.Series(col_dates, dtype=object).to_numpy()
+    available_matrix = available.to_numpy(dtype=bool)
+    employees = []
+    for row_pos, (row_id, name, desired_shifts) in enumerate(zip(ids, names, desired.astype(int))):
+        existing = existing_by_id.get(row_id) or existing_by_name.get(name)
+        emp_id = existing['id'] if existing else (row_id or str(uuid.uuid4()))
+        employees.append({'id': emp_id, 'name': name, 'desired_shifts': int(desired_shifts), 'available_dates': list(date_array[available_matrix[row_pos]]), **{key: values[row_pos] for key, values in limits.items()}})
+    return employees, []
+
+
+def parse_timetable(timetable_df, period_start, period_end):
+    """タイムテーブルの表を検証し、(日付 → シフト枠のリスト, エラーメッセージのリスト) を返す。
+
+    開始・終了が空欄でシフト名がプリセット名なら、プリセットの時刻を使う。期間外の行は読み飛ばす。
+    """
+    missing_cols = [c for c in TIMETABLE_COLUMNS if c not in timetable_df.columns]
+    if missing_cols:
+        return {}, [f"タイムテーブルに「{c}」列がありません。" for c in missing_cols]
+    errors = []
+    df = timetable_df[list(TIMETABLE_COLUMNS)].apply(lambda col: col.astype(str).str.strip())
+    row_labels = pd.Series(range(2, len(df) + 2), index=df.index)
+    dates = pd.to_datetime(df["日付"], errors="coerce", format="mixed").dt.date
+    presets = {p["name"]: p for p in SHIFT_PRESETS}
+    preset_start = df["シフト名"].map(lambda name: presets[name]["start_time"] if name in presets else None)
+    preset_end = df["シフト名"].map(lambda name: presets[name]["end_time"] if name in presets else None)
+    start_times = pd.to_datetime(df["開始"].where(df["開始"] != ""), errors="coerce", format="mixed").dt.time.where(df["開始"] != "", preset_start)
+    end_times = pd.to_datetime(df["終了"].where(df["終了"] != ""), errors="coerce", format="mixed").dt.time.where(df["終了"] != "", preset_end)
+    required = pd.to_numeric(df["必要人数"], errors="coerce")
+    checks = [
+        (dates.isna(), "日付が読めません"),
+        (df["シフト名"] == "", "シフト名が空です"),
+        (start_times.isna() | end_times.isna(), "開始・終了時刻が読めません (プリセット名なら空欄可)"),
+        (pd.Series([pd.notna(s) and pd.notna(e) and s >= e for s, e in zip(start_times, end_times)], index=df.index), "終了時刻は開始時刻より後にしてください"),
+        (required.isna() | (required < 1) | (required % 1 != 0), "必要人数は 1 以上の整数で入力してください"),
+    ]
+    for invalid, message in checks:
+        bad_rows = row_labels[invalid.fillna(True).astype(bool)]
+        if not bad_rows.empty: errors.append(f"{message} (行 {', '.join(map(str, bad_rows))})。")
+    if errors:
+        return {}, errors
+    timetable = {}
+    for date_val, name, start_time, end_time, req_people in zip(dates, df["シフト名"], start_times, end_times, required.astype(int)):
+        if period_start <= date_val <= period_end:
+            timetable.setdefault(date_val, []).append({'id': str(uuid.uuid4()), 'name': name, 'start_time': start_time, 'end_time': end_time, 'required_people': int(req_people)})
+    return timetable, []
+
+
+def build_roster_template(employees, period_start, period_end):
+    """現在のスタッフと勤務可能日を取り込み用の表の形にする (テンプレートとして配布する)。"""
+    dates = [period_start + datetime.timedelta(days=x) for x in range((period_end - period_start).days + 1)]
+    rows = []
+    for emp in employees:
+        available = set(emp['available_dates'])
+        rows.append({"ID": emp['id'], "名前": emp['name'], "希望日数": emp['desired_shifts'], **{label: emp.get(key) for key, label in STAFF_LIMITS.items()}, **{d.isoformat(): ("○" if d in available else "") for d in dates}})
+    return pd.DataFrame(rows, columns=["ID", "名前", "希望日数", *STAFF_LIMITS.values()] + [d.isoformat() for d in dates])
@@ -0,0 +1,271 @@
+import datetime
+import queue
+import sqlite3
+from collections import defaultdict
+from contextlib import contextmanager
+
+from shift_cache import REVISION_KINDS
+from shift_engine import STAFF_LIMITS, build_positions
+from shift_template import RecurringTimetable, rules_from_config
+
+# --- SQLite による永続化 ---
+# スタッフ・勤務可能日・シフト枠・割当結果を 1 つの SQLite ファイルに保存する。
+# シフト枠は毎週の定型枠 (weekly_rules)・日付ごとに追加した枠 (shift_slots)・
+# その日だけ外した定型枠 (slot_exceptions) で持つ (shift_template を参照)。
+# 書き込みは編集 1 件ごとの小さなトランザクションで行い、同じトランザクション内で
+# 対象データ (employees / timetable / schedule) のリビジョンを進める。
+# 各セッションはリビジョンが変わったデータだけを読み直せばよい。
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS employees (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    desired_shifts INTEGER NOT NULL,
+    sort_order INTEGER NOT NULL,
+    max_daily_shifts INTEGER,
+    max_daily_hours REAL,
+    max_weekly_hours REAL,
+    min_rest_hours REAL
+);
+CREATE TABLE IF NOT EXISTS availability (
+    employee_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (employee_id, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shift_slots (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    required_people INTEGER NOT NULL,
+    sort_order INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_shift_slots_date ON shift_slots (date, id);
+CREATE TABLE IF NOT EXISTS weekly_rules (
+    id TEXT PRIMARY KEY,
+    weekday INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    required_people INTEGER NOT NULL,
+    sort_order INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slot_exceptions (
+    date TEXT NOT NULL,
+    rule_id TEXT NOT NULL,
+    PRIMARY KEY (date, rule_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS assignments (
+    date TEXT NOT NULL,
+    shift_id TEXT NOT NULL,
+    position_index INTEGER NOT NULL,
+    employee_id TEXT NOT NULL,
+    PRIMARY KEY (date, shift_id, position_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_assignments_employee ON assignments (employee_id, date);
+CREATE TABLE IF NOT EXISTS generated_periods (
+    period_start TEXT NOT NULL,
+    period_end TEXT NOT NULL,
+    PRIMARY KEY (period_start, period_end)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS revisions (
+    kind TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+LIMIT_COLUMNS = list(STAFF_LIMITS)  # employees の勤務条件の列 (NULL なら制限なし)
+
+
+class ShiftStore:
+    """SQLite ファイルへの読み書き。接続はプールして複数のセッション (スレッド) で共有する。"""
+
+    def __init__(self, path, pool_size=4):
+        self.path = path
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        with self.transaction() as conn:
+            conn.executescript(SCHEMA)
+            # 勤務条件の列がない古いファイルには列を足す
+            existing_columns = {row[1] for row in conn.execute("PRAGMA table_info(employees)")}
+            for column in LIMIT_COLUMNS:
+                if column not in existing_columns:
+                    conn.execute(f"ALTER TABLE employees ADD COLUMN {column} {'INTEGER' if column == 'max_daily_shifts' else 'REAL'}")
+            conn.executemany("INSERT OR IGNORE INTO revisions (kind, revision) VALUES (?, 0)", [(kind,) for kind in REVISION_KINDS])
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'weekly_rules_seeded'").fetchone() is None:
+                # 新しいファイルには既定の定型シフト枠を入れる (日付ごとのシフト枠を保存済みの古いファイルはそのまま)
+                if conn.execute("SELECT COUNT(*) FROM shift_slots").fetchone()[0] == 0:
+                    self._insert_rules(conn, rules_from_config()[0])
+                conn.execute("INSERT INTO meta (key, value) VALUES ('weekly_rules_seeded', '1')")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'generated_periods_seeded'").fetchone() is None:
+                # 生成した期間を記録していない古いファイルは、保存済みの割当の最初の日〜最後の日を生成済みとみなす
+                conn.execute("INSERT OR IGNORE INTO generated_periods (period_start, period_end) SELECT MIN(date), MAX(date) FROM assignments HAVING COUNT(*) > 0")
+                conn.execute("INSERT INTO meta (key, value) VALUES ('generated_periods_seeded', '1')")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self, *kinds):
+        """1 つのトランザクションで書き込み、kinds のリビジョンを進める。"""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+                conn.executemany("UPDATE revisions SET revision = revision + 1 WHERE kind = ?", [(kind,) for kind in kinds])
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get().close()
+
+    # --- 読み込み ---
+    def revisions(self):
+        with self.connection() as conn:
+            return dict(conn.execute("SELECT kind, revision FROM revisions").fetchall())
+
+    def load_employees(self):
+        with self.connection() as conn:
+            available = defaultdict(list)
+            for emp_id, date_str in conn.execute("SELECT employee_id, date FROM availability ORDER BY employee_id, date"):
+                available[emp_id].append(datetime.date.fromisoformat(date_str))
+            rows = conn.execute(f"SELECT id, name, desired_shifts, {', '.join(LIMIT_COLUMNS)} FROM employees ORDER BY sort_order")
+            return [{'id': emp_id, 'name': name, 'desired_shifts': desired_shifts, 'available_dates': available.get(emp_id, []), **dict(zip(LIMIT_COLUMNS, limits))} for emp_id, name, desired_shifts, *limits in rows]
+
+    def load_timetable(self, period_start, period_end):
+        """期間のタイムテーブル (RecurringTimetable) を返す。日付ごとのシフト枠は参照されたときに組み立てる。"""
+        period = (period_start.isoformat(), period_end.isoformat())
+        dated_slots = defaultdict(list)
+        with self.connection() as conn:
+            rules = [{'id': rule_id, 'weekday': weekday, 'name': name, 'start_time': datetime.time.fromisoformat(start_time), 'end_time': datetime.time.fromisoformat(end_time), 'required_people': required_people} for rule_id, weekday, name, start_time, end_time, required_people in conn.execute("SELECT id, weekday, name, start_time, end_time, required_people FROM weekly_rules ORDER BY sort_order")]
+            rows = conn.execute("SELECT id, date, name, start_time, end_time, required_people FROM shift_slots WHERE date BETWEEN ? AND ? ORDER BY date, sort_order", period)
+            for slot_id, date_str, name, start_time, end_time, required_people in rows:
+                dated_slots[datetime.date.fromisoformat(date_str)].append({'id': slot_id, 'name': name, 'start_time': datetime.time.fromisoformat(start_time), 'end_time': datetime.time.fromisoformat(end_time), 'required_people': required_people})
+            exceptions = [(datetime.date.fromisoformat(date_str), rule_id) for date_str, rule_id in conn.execute("SELECT date, rule_id FROM slot_exceptions WHERE date BETWEEN ? AND ?", period)]
+        return RecurringTimetable(rules, period_start, period_end, dict(dated_slots), exceptions)
+
+    def is_generated(self, period_start, period_end):
+        """期間のすべての日が、これまでに生成した期間のどれかに含まれていれば True (開始日が終了日より後なら False)。"""
+        if period_start > period_end:
+            return False
+        with self.connection() as conn:
+            rows = conn.execute("SELECT period_start, period_end FROM generated_periods WHERE period_start <= ? AND period_end >= ? ORDER BY period_start", (period_end.isoformat(), period_start.isoformat())).fetchall()
+        covered_until = period_start - datetime.timedelta(days=1)
+        for start_str, end_str in rows:
+            if datetime.date.fromisoformat(start_str) > covered_until + datetime.timedelta(days=1):
+                return False
+            covered_until = max(covered_until, datetime.date.fromisoformat(end_str))
+        return covered_until >= period_end
+
+    def load_schedule(self, timetable, employees, period_start, period_end):
+        """保存済みの割当を timetable のポジション (PositionTable) に当てはめて返す。期間内にまだ生成していない日があれば None。"""
+        if not self.is_generated(period_start, period_end):
+            return None
+        positions = build_positions(timetable, period_start, period_end)
+        slot_lookup = {(date_val, slot_id): slot for slot, (date_val, slot_id) in enumerate(zip(positions.slot_date, positions.slot_id))}
+        names = {emp['id']: emp['name'] for emp in employees}
+        with self.connection() as conn:
+            rows = conn.execute("SELECT date, shift_id, position_index, employee_id FROM assignments WHERE date BETWEEN ? AND ?", (period_start.isoformat(), period_end.isoformat()))
+            for date_str, shift_id, position_index, emp_id in rows:
+                slot = slot_lookup.get((datetime.date.fromisoformat(date_str), shift_id))
+                if slot is not None and emp_id in names and position_index < len(positions.slot_positions(slot)):
+                    positions.assign(positions.slot_first[slot] + position_index, emp_id, names[emp_id])
+        return positions
+
+    # --- 書き込み ---
+    def add_employee(self, employee):
+        with self.transaction("employees") as conn:
+            conn.execute(f"INSERT INTO employees (id, name, desired_shifts, sort_order, {', '.join(LIMIT_COLUMNS)}) VALUES (?, ?, ?, (SELECT COALESCE(MAX(sort_order), -1) + 1 FROM employees), {', '.join('?' * len(LIMIT_COLUMNS))})", (employee['id'], employee['name'], employee['desired_shifts'], *(employee.get(column) for column in LIMIT_COLUMNS)))
+            conn.executemany("INSERT OR IGNORE INTO availability (employee_id, date) VALUES (?, ?)", [(employee['id'], d.isoformat()) for d in employee['available_dates']])
+
+    def set_available_dates(self, emp_id, available_dates):
+        with self.transaction("employees") as conn:
+            conn.execute("DELETE FROM availability WHERE employee_id = ?", (emp_id,))
+            conn.executemany("INSERT OR IGNORE INTO availability (employee_id, date) VALUES (?, ?)", [(emp_id, d.isoformat()) for d in available_dates])
+
+    def set_limits(self, emp_id, limits):
+        """勤務条件 (STAFF_LIMITS のキー → 値、None なら制限なし) を更新する。"""
+        with self.transaction("employees") as conn:
+            conn.execute(f"UPDATE employees SET {', '.join(f'{column} = ?' for column in LIMIT_COLUMNS)} WHERE id = ?", (*(limits.get(column) for column in LIMIT_COLUMNS), emp_id))
+
+    def delete_employee(self, emp_id):
+        with self.transaction("employees") as conn:
+            conn.execute("DELETE FROM availability WHERE employee_id = ?", (emp_id,))
+            conn.execute("DELETE FROM employees WHERE id = ?", (emp_id,))
+
+    def import_employees(self, employees, period_start, period_end):
+        """スタッフをまとめて追加・更新し、期間内の勤務可能日を置き換える (1 トランザクション)。
+
+        既存スタッフの勤務条件は、employees の dict にキーがあるものだけを上書きする。
+        """
+        updated_limits = [column for column in LIMIT_COLUMNS if any(column in emp for emp in employees)]
+        with self.transaction("employees") as conn:
+            next_order = conn.execute("SELECT COALESCE(MAX(sort_order), -1) + 1 FROM employees").fetchone()[0]
+            conn.executemany(f"INSERT INTO employees (id, name, desired_shifts, sort_order, {', '.join(LIMIT_COLUMNS)}) VALUES (?, ?, ?, ?, {', '.join('?' * len(LIMIT_COLUMNS))}) ON CONFLICT (id) DO UPDATE SET name = excluded.name, desired_shifts = excluded.desired_shifts{''.join(f', {column} = excluded.{column}' for column in updated_limits)}", [(emp['id'], emp['name'], emp['desired_shifts'], next_order + i, *(emp.get(column) for column in LIMIT_COLUMNS)) for i, emp in enumerate(employees)])
+            conn.executemany("DELETE FROM availability WHERE employee_id = ? AND date BETWEEN ? AND ?", [(emp['id'], period_start.isoformat(), period_end.isoformat()) for emp in employees])
+            conn.executemany("INSERT OR IGNORE INTO availability (employee_id, date) VALUES (?, ?)", [(emp['id'], d.isoformat()) for emp in employees for d in emp['available_dates']])
+
+    def add_slots(self, dated_slots):
+        """(日付, シフト枠 dict) のリストをまとめて追加する。"""
+        with self.transaction("timetable") as conn:
+            next_order = conn.execute("SELECT COALESCE(MAX(sort_order), -1) + 1 FROM shift_slots").fetchone()[0]
+            conn.executemany("INSERT INTO shift_slots (id, date, name, start_time, end_time, required_people, sort_order) VALUES (?, ?, ?, ?, ?, ?, ?)", [(slot['id'], date_val.isoformat(), slot['name'], slot['start_time'].isoformat(), slot['end_time'].isoformat(), slot['required_people'], next_order + i) for i, (date_val, slot) in enumerate(dated_slots)])
+
+    def delete_slot(self, slot_id):
+        with self.transaction("timetable") as conn:
+            conn.execute("DELETE FROM shift_slots WHERE id = ?", (slot_id,))
+
+    def _insert_rules(self, conn, rules):
+        next_order = conn.execute("SELECT COALESCE(MAX(sort_order), -1) + 1 FROM weekly_rules").fetchone()[0]
+        conn.executemany("INSERT INTO weekly_rules (id, weekday, name, start_time, end_time, required_people, sort_order) VALUES (?, ?, ?, ?, ?, ?, ?)", [(rule['id'], rule['weekday'], rule['name'], rule['start_time'].isoformat(), rule['end_time'].isoformat(), rule['required_people'], next_order + i) for i, rule in enumerate(rules)])
+
+    def add_rule(self, rule):
+        """毎週の定型シフト枠を追加する。"""
+        with self.transaction("timetable") as conn:
+            self._insert_rules(conn, [rule])
+
+    def delete_rule(self, rule_id):
+        with self.transaction("timetable") as conn:
+            conn.execute("DELETE FROM slot_exceptions WHERE rule_id = ?", (rule_id,))
+            conn.execute("DELETE FROM weekly_rules WHERE id = ?", (rule_id,))
+
+    def skip_rule(self, date_val, rule_id):
+        """定型シフト枠をその日だけ外す。"""
+        with self.transaction("timetable") as conn:
+            conn.execute("INSERT OR IGNORE INTO slot_exceptions (date, rule_id) VALUES (?, ?)", (date_val.isoformat(), rule_id))
+
+    def restore_rule(self, date_val, rule_id):
+        with self.transaction("timetable") as conn:
+            conn.execute("DELETE FROM slot_exceptions WHERE date = ? AND rule_id = ?", (date_val.isoformat(), rule_id))
+
+    def save_schedule(self, positions, period_start, period_end, previous=None):
+        """期間内の割当を positions (PositionTable) で置き換え、期間を生成済みとして記録する。
+
+        previous (保存済みの割当を読み込んだ PositionTable) を渡すと、期間を消して入れ直す代わりに
+        担当者が変わったポジションだけを書き換える (編集のたびの組み直し用)。
+        """
+        with self.transaction("schedule") as conn:
+            conn.execute("INSERT OR IGNORE INTO generated_periods (period_start, period_end) VALUES (?, ?)", (period_start.isoformat(), period_end.isoformat()))
+            if previous is None:
+                conn.execute("DELETE FROM assignments WHERE date BETWEEN ? AND ?", (period_start.isoformat(), period_end.isoformat()))
+                conn.executemany("INSERT INTO assignments (date, shift_id, position_index, employee_id) VALUES (?, ?, ?, ?)", [(date_val.isoformat(), shift_id, position_index, emp_id) for date_val, shift_id, position_index, emp_id in positions.iter_assignments()])
+            else:
+                old = {(date_val, shift_id, position_index): emp_id for date_val, shift_id, position_index, emp_id in previous.iter_assignments()}
+                new = {(date_val, shift_id, position_index): emp_id for date_val, shift_id, position_index, emp_id in positions.iter_assignments()}
+                conn.executemany("DELETE FROM assignments WHERE date = ? AND shift_id = ? AND position_index = ?", [(date_val.isoformat(), shift_id, position_index) for date_val, shift_id, position_index in old.keys() - new.keys()])
+                conn.executemany("INSERT OR REPLACE INTO assignments (date, shift_id, position_index, employee_id) VALUES (?, ?, ?, ?)", [(date_val.isoformat(), shift_id, position_index, emp_id) for (date_val, shift_id, position_index), emp_id in new.items() if old.get((date_val, shift_id, position_index)) != emp_id])
+
@@ -0,0 +1,78 @@
+import datetime
+from collections import defaultdict
+from collections.abc import Mapping
+
+from shift_engine import DEFAULT_SHIFTS_CONFIG, SHIFT_PRESETS
+
+# --- 毎週の定型シフト枠 ---
+# タイムテーブルを「曜日ごとの定型シフト枠 (ルール)」「日付ごとに追加したシフト枠」
+# 「その日だけ外した定型枠 (例外)」で持ち、日付ごとのシフト枠は参照されたときに組み立てる。
+# 期間を変えても日付ごとのデータは作らない。定型枠から作るシフト枠の ID は
+# "<ルールID>@<日付>" なので、読み込み直しても同じ ID になる (保存済みの割当はこの ID で突き合わせる)。
+
+WEEKDAY_NAMES = ["月", "火", "水", "木", "金", "土", "日"]
+
+
+def rule_slot_id(rule_id, date_val):
+    return f"{rule_id}@{date_val.isoformat()}"
+
+
+def rules_from_config(shifts_config=DEFAULT_SHIFTS_CONFIG):
+    """曜日 → [(プリセット名, 必要人数)] の設定から定型シフト枠を作り、(ルールのリスト, 見つからなかったプリセット名のリスト) を返す。"""
+    presets = {p["name"]: p for p in SHIFT_PRESETS}
+    rules, missing = [], []
+    for weekday in sorted(shifts_config):
+        for k, (preset_name, req_people) in enumerate(shifts_config[weekday]):
+            preset = presets.get(preset_name)
+            if preset is None:
+                missing.append(preset_name)
+                continue
+            rules.append({'id': f"default-{weekday}-{k}", 'weekday': weekday, 'name': preset["name"], 'start_time': preset["start_time"], 'end_time': preset["end_time"], 'required_people': req_people})
+    return rules, missing
+
+
+class RecurringTimetable(Mapping):
+    """日付 → シフト枠のリスト の Mapping (期間内でシフト枠のある日だけを持つ)。
+
+    rules は {'id', 'weekday', 'name', 'start_time', 'end_time', 'required_people'} のリスト、
+    dated_slots は日付 → 追加したシフト枠のリスト、exceptions は外した (日付, ルールID) の集合。
+    その日のシフト枠は定型枠 (ルールの登録順)、追加したシフト枠の順。定型枠から作るシフト枠には 'rule_id' を持たせる。
+    """
+
+    def __init__(self, rules, period_start, period_end, dated_slots=None, exceptions=()):
+        self.rules = list(rules)
+        self.period_start, self.period_end = period_start, period_end
+        self.dated_slots = dated_slots or {}
+        self.exceptions = set(exceptions)
+        self._rules_by_weekday = defaultdict(list)
+        for rule in self.rules:
+            self._rules_by_weekday[rule['weekday']].append(rule)
+
+    def _active_rules(self, date_val):
+        return [rule for rule in self._rules_by_weekday.get(date_val.weekday(), ()) if (date_val, rule['id']) not in self.exceptions]
+
+    def skipped_rules(self, date_val):
+        """その日だけ外している定型枠のリスト。"""
+        return [rule for rule in self._rules_by_weekday.get(date_val.weekday(), ()) if (date_val, rule['id']) in self.exceptions]
+
+    def __getitem__(self, date_val):
+        if not isinstance(date_val, datetime.date) or not self.period_start <= date_val <= self.period_end:
+            raise KeyError(date_val)
+        slots = [{'id': rule_slot_id(rule['id'], date_val), 'name': rule['name'], 'start_time': rule['start_time'], 'end_time': rule['end_time'], 'required_people': rule['required_people'], 'rule_id': rule['id']} for rule in self._active_rules(date_val)]
+        slots += self.dated_slots.get(date_val, [])
+        if not slots:
+            raise KeyError(date_val)
+        return slots
+
+    def __contains__(self, date_val):
+        return isinstance(date_val, datetime.date) and self.period_start <= date_val <= self.period_end and bool(self.dated_slots.get(date_val) or self._active_rules(date_val))
+
+    def __iter__(self):
+        date_val = self.period_start
+        while date_val <= self.period_end:
+            if date_val in self:
+                yield date_val
+            date_val += datetime.timedelta(days=1)
+
+    def __len__(self):
+        return sum(1 for _ in self)